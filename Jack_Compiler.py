@@ -1,70 +1,526 @@
 import sys
 import os
-from token_reader import TokenReader
+import argparse
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from token_reader import TokenReader, StreamingTokenReader
 from symbol_table import SymbolTable
 from error_reporter import ErrorReporter
 from vm_writer import VMWriter
 from compilation_engine import CompilationEngine
+import peephole
+from compile_options import CompileOptions
+from build_cache import BuildCache, CACHE_FILE_NAME, default_cache_path
+from class_index import ClassIndex, INDEX_FILE_NAME, default_index_path
+import compile_server
+import whole_program
+import hack_asm
+from profiler import Profiler, ProfileReport, ENGINE_PREFIXES, READER_METHODS, SYMBOL_METHODS, WRITER_PREFIXES
+from diagnostics import FORMATS, open_sink
 
 def vm_output_path(token_path):
     base = os.path.basename(token_path)
-    name = base[:-8]
+    name = base[:-5] if base.endswith('.jack') else base[:-8]
     return os.path.join(os.path.dirname(token_path), name + '.vm')
 
-def compile_one(path):
-    reporter = ErrorReporter()
-    tr = TokenReader(path, reporter)
+def open_token_reader(path, reporter, options):
+    if options.stream_tokens:
+        return StreamingTokenReader(path, reporter, options.lookahead)
+    return TokenReader(path, reporter)
+
+class CompileResult:
+    # What compile_file hands back to the driver, possibly from a worker
+    # process. `text` holds the VM code when it was not written to `out`:
+    # the VM text, or for the asm target the (code, names) instruction stream
+    # of the VMWriter. `profile` holds Profiler.data() when profiling is
+    # enabled, `signature` the (class name, subroutines, calls) for the
+    # class index when calls are checked.
+    def __init__(self, path, out, reporter, text=None, profile=None, signature=None):
+        self.path = path
+        self.out = out
+        self.reporter = reporter
+        self.text = text
+        self.profile = profile
+        self.signature = signature
+
+def compile_file(path, options=None, diagnostics=None):
+    # Compiles a single token file without printing anything, so it can run
+    # in a worker process; the caller decides when to show the diagnostics.
+    # A diagnostics sink, when given, gets them as they are reported.
+    options = options or CompileOptions()
+    if options.profile:
+        profiler = Profiler(trace=options.profile_trace)
+        result = profiler.record_file(path, _compile_file, path, options, profiler, diagnostics)
+        result.profile = profiler.data()
+        return result
+    return _compile_file(path, options, diagnostics=diagnostics)
+
+def _compile_file(path, options, profiler=None, diagnostics=None):
+    reporter = ErrorReporter(options.max_errors, diagnostics)
+    if profiler is None:
+        tr = open_token_reader(path, reporter, options)
+    else:
+        tr = profiler.call("reader.load", open_token_reader, path, reporter, options)
     out = vm_output_path(path)
     vmw = VMWriter(out)
     sym = SymbolTable()
-    engine = CompilationEngine(tr, vmw, sym, reporter, path)
+    engine = CompilationEngine(tr, vmw, sym, reporter, path, options.opt_level, options.strings, options.cse,
+                               options.branch_layout, options.array_stores, options.labels)
+    if profiler is not None:
+        profiler.instrument(engine, "engine", prefixes=ENGINE_PREFIXES)
+        profiler.instrument(tr, "reader", names=READER_METHODS)
+        profiler.instrument(sym, "symbols", names=SYMBOL_METHODS)
+        profiler.instrument(vmw, "writer", names=("text", "save"), prefixes=WRITER_PREFIXES)
     engine.compile_class()
+    if options.max_errors and reporter.truncated and len(reporter.errors) >= options.max_errors:
+        reporter.add_note(path, f"[ERRORS] {os.path.basename(path)}: stopped after {reporter.max_errors} errors (--max-errors)")
+    if options.cse:
+        reporter.add_note(path, f"[CSE] {os.path.basename(out)}: {engine.cse_reused} subexpressions reused, "
+                                f"{engine.cse_loads_eliminated} array loads eliminated")
+    if options.array_stores == "direct":
+        # A direct store is two instructions shorter: no pop/push of temp 0.
+        reporter.add_note(path, f"[ARRAY] {os.path.basename(out)}: {engine.direct_array_stores} of {engine.array_store_count} "
+                                f"array stores lowered directly, -{2 * engine.direct_array_stores} instructions")
+    if options.peephole_rules:
+        code = vmw.instructions()
+        before = peephole.instruction_count(code)
+        if profiler is None:
+            code = peephole.optimize(code, options.peephole_rules)
+        else:
+            code = profiler.call("peephole.optimize", peephole.optimize, code, options.peephole_rules)
+        vmw.set_instructions(code)
+        after = peephole.instruction_count(code)
+        saved = before - after
+        percent = 100.0 * saved / before if before else 0.0
+        reporter.add_note(path, f"[OPT] {os.path.basename(out)}: {before} -> {after} instructions (-{saved}, {percent:.1f}%)")
+    signature = None
+    if options.check_calls and engine.class_name is not None:
+        signature = (engine.class_name, engine.subroutines, engine.calls)
+    if options.in_memory:
+        if options.target == "asm":
+            return CompileResult(path, out, reporter, (vmw.code, vmw.names), signature=signature)
+        return CompileResult(path, out, reporter, vmw.text(), signature=signature)
     vmw.save()
-    reporter.show()
-    print(f"[✓] Generated: {out}")
-    return len(reporter.errors), len(reporter.warnings)
+    return CompileResult(path, out, reporter, signature=signature)
 
-def main():
-    if(len(sys.argv) < 2):
-        print("Usage: python Compiler.py <source_file>")
-        sys.exit(2)
+def limit_to_budget(reporter, diagnostics):
+    # A file compiled in a worker or restored from the cache had no sink, so
+    # --stop-after did not stop it. Drops the errors past what is left of the
+    # budget (and the warnings after the last kept error), as a serial
+    # compile would have stopped there. Returns True when the file uses up
+    # the budget.
+    if diagnostics is None or reporter.sink is not None or not diagnostics.max_errors:
+        return False
+    left = max(0, diagnostics.max_errors - diagnostics.errors)
+    if len(reporter.errors) < left:
+        return False
+    if len(reporter.errors) > left:
+        del reporter.errors[left:]
+        last = reporter.errors[-1][1] if reporter.errors else -1
+        reporter.warnings = [w for w in reporter.warnings if w[1] <= last]
+    return True
+
+def report_file(result, cached=False, sink=None, profile=None, diagnostics=None, index=None):
+    if profile is not None and result.profile is not None:
+        profile.merge(result.profile)
+    if index is not None and result.signature is not None:
+        index.update(result.path, *result.signature, errors=bool(result.reporter.errors))
+    if diagnostics is not None and result.reporter.sink is None:
+        limit_to_budget(result.reporter, diagnostics)
+        result.reporter.replay(diagnostics)
+    result.reporter.show()
+    if cached:
+        print(f"[=] Up to date: {result.out}")
+    elif sink is not None:
+        sink.write(result.out, result.text)
+        print(f"[✓] Compiled: {result.path}")
+    else:
+        print(f"[✓] Generated: {result.out}")
+    return len(result.reporter.errors), len(result.reporter.warnings)
+
+def compile_one(path, cache=None, options=None, sink=None, profile=None, diagnostics=None, index=None):
+    # A cached file is recompiled when the class index has no current entry
+    # for it.
+    if cache is not None and (index is None or index.is_current(path)):
+        out = vm_output_path(path)
+        reporter = cache.lookup(path, out)
+        if reporter is not None:
+            return report_file(CompileResult(path, out, reporter), cached=True, diagnostics=diagnostics)
+    result = compile_file(path, options, diagnostics)
+    # A file cut short by --stop-after is not cached.
+    if cache is not None and not (diagnostics is not None and diagnostics.full()):
+        cache.store(path, result.out, result.reporter)
+    return report_file(result, sink=sink, profile=profile, diagnostics=diagnostics, index=index)
+
+def compile_all(fileNames, jobs=1, cache=None, options=None, sink=None, profile=None, diagnostics=None, index=None):
+    # Yields (errors, warnings) per file in the order of fileNames. With more
+    # than one job the files are compiled in worker processes, but results are
+    # still reported in input order so the output matches a serial run. Stops
+    # early once the diagnostics sink is full.
+    if jobs <= 1 or len(fileNames) < 2:
+        for f in fileNames:
+            if diagnostics is not None and diagnostics.full():
+                return
+            print(f"[INFO] Compiling: {f}")
+            yield compile_one(f, cache, options, sink, profile, diagnostics, index)
+        return
+    with ProcessPoolExecutor(max_workers=min(jobs, len(fileNames))) as pool:
+        pending = []
+        for f in fileNames:
+            out = vm_output_path(f)
+            cached = None
+            if cache is not None and (index is None or index.is_current(f)):
+                cached = cache.lookup(f, out)
+            future = pool.submit(compile_file, f, options) if cached is None else None
+            pending.append((f, out, cached, future))
+        for f, out, cached, future in pending:
+            if diagnostics is not None and diagnostics.full():
+                for _, _, _, rest in pending:
+                    if rest is not None:
+                        rest.cancel()
+                return
+            print(f"[INFO] Compiling: {f}")
+            if cached is not None:
+                yield report_file(CompileResult(f, out, cached), cached=True, diagnostics=diagnostics)
+                continue
+            result = future.result()
+            # Like compile_one, a file cut short by --stop-after is not cached.
+            if not limit_to_budget(result.reporter, diagnostics) and cache is not None:
+                cache.store(f, result.out, result.reporter)
+            yield report_file(result, sink=sink, profile=profile, diagnostics=diagnostics, index=index)
 
-    input_path = sys.argv[1]
+class BundleSink:
+    # Writes every class's VM code to one stream. The VM spec scopes statics
+    # per file, so each class starts with a '// file: Name.vm' marker that a
+    # consumer can split on.
+    def __init__(self, stream):
+        self.stream = stream
 
+    def write(self, out, text):
+        self.stream.write(f"// file: {os.path.basename(out)}\n")
+        self.stream.write(text)
+
+class ProgramSink:
+    # Holds every class's VM code until the whole program has been compiled,
+    # then optionally inlines trivial accessors, drops the functions nothing
+    # reaches and writes the rest to the .vm files or to another sink.
+    # extra_roots are the functions called from outside the compiled classes
+    # (prebuilt .vm files), which must survive even if nothing here calls them.
+    def __init__(self, inline=False, extra_roots=()):
+        self.outputs = []
+        self.inline = inline
+        self.extra_roots = extra_roots
+
+    def write(self, out, text):
+        if not isinstance(text, str):
+            # The whole-program passes work on VM text.
+            vm = VMWriter(out)
+            vm.code, vm.names = text
+            text = vm.text()
+        self.outputs.append((out, text))
+
+    def finish(self, sink=None):
+        program = self.outputs
+        inlined = None
+        if self.inline:
+            program, inlined = whole_program.inline_accessors(program)
+        outputs, removed = whole_program.eliminate_dead_functions(program, extra_roots=self.extra_roots)
+        for out, text in outputs:
+            if sink is not None:
+                sink.write(out, text)
+            else:
+                with open(out, 'w') as f:
+                    f.write(text)
+                print(f"[✓] Generated: {out}")
+        if inlined is not None:
+            calls = sum(inlined.values())
+            print(f"[INLINE] Inlined {calls} calls to {len(inlined)} trivial accessors: {calls} call frames removed")
+            for name, count in inlined.items():
+                print(f"[INLINE]   {name} ({count} calls)")
+        if removed is None:
+            print(f"[DCE] No entry point ({', '.join(whole_program.ENTRY_POINTS)}) in the program; nothing removed.")
+            return
+        before = sum(whole_program.instruction_count(text.splitlines()) for _, text in program)
+        instructions = sum(r.instructions for r in removed)
+        size = sum(r.bytes for r in removed)
+        print(f"[DCE] Removed {len(removed)} unreachable functions: -{instructions} of {before} instructions, -{size} bytes")
+        for r in removed:
+            print(f"[DCE]   {r.name} ({r.instructions} instructions)")
+
+class AsmSink:
+    # Translates every class to Hack assembly as it arrives, from the
+    # compiler's instruction stream or from VM text, and writes one .asm
+    # program at the end.
+    def __init__(self):
+        self.asm = hack_asm.AsmWriter()
+
+    def write(self, out, vm):
+        if isinstance(vm, str):
+            vm = hack_asm.read_vm(vm)
+        self.asm.add_class(os.path.splitext(os.path.basename(out))[0], *vm)
+
+    def finish(self, stream):
+        text = self.asm.text()
+        stream.write(text)
+        unresolved = self.asm.unresolved()
+        if self.asm.entry_point() is None:
+            print(f"[ASM] Warning: no {' or '.join(hack_asm.BOOT_ENTRY_POINTS)} in the program; the bootstrap calls {hack_asm.BOOT_ENTRY_POINTS[0]}.")
+        if unresolved:
+            print(f"[ASM] Warning: {len(unresolved)} called functions are not defined: {', '.join(unresolved)}")
+        print(f"[ASM] {self.asm.vm_instructions} VM instructions -> {hack_asm.instruction_count(text)} Hack instructions")
+
+def asm_output_path(input_path):
+    # Like the VM translator: Dir/Dir.asm for a directory, Name.asm for a file.
+    path = os.path.normpath(input_path)
+    if os.path.isdir(path):
+        return os.path.join(path, os.path.basename(os.path.abspath(path)) + ".asm")
+    return vm_output_path(path)[:-3] + ".asm"
+
+def prebuilt_vm_files(input_path, fileNames):
+    # .vm files in the input directory that no source produces, e.g. the OS.
+    if not os.path.isdir(input_path):
+        return []
+    compiled = {vm_output_path(f) for f in fileNames}
+    return [os.path.join(input_path, f) for f in sorted(os.listdir(input_path))
+            if f.endswith(".vm") and os.path.join(input_path, f) not in compiled]
+
+def collect_sources(input_path):
     fileNames = []
 
     if os.path.isdir(input_path):
-        for filename in os.listdir(input_path):
-            if filename.endswith("_myT.xml"):
+        # A class with both a .jack source and a token file is compiled from
+        # the source; the token file is only used when it stands alone.
+        listing = sorted(os.listdir(input_path))
+        sources = {f[:-5] for f in listing if f.endswith(".jack")}
+        for filename in listing:
+            if filename.endswith(".jack") or (filename.endswith("_myT.xml") and filename[:-8] not in sources):
                 fileNames.append(os.path.join(input_path, filename))
-    
 
     elif os.path.isfile(input_path):
-        if input_path.endswith("_myT.xml"):
+        if input_path.endswith("_myT.xml") or input_path.endswith(".jack"):
             fileNames.append(input_path)
         else:
-            print("Error: Input file must be tokenized XML file with '_myT.xml' suffix.")
-            sys.exit(2)
-    
+            raise ValueError("Error: Input file must be a Jack source (.jack) or tokenized XML file with '_myT.xml' suffix.")
+
     else:
-        print("Error: Input path is neither a file nor a directory.")
-        sys.exit(2)
-    
+        raise ValueError("Error: Input path is neither a file nor a directory.")
+
     if not fileNames:
-        print("No token files found (expected *_myT.xml)")
+        raise ValueError("No source files found (expected *.jack or *_myT.xml)")
+    return fileNames
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="Jack_Compiler.py", description="Compile Jack sources (*.jack) or tokenized Jack (*_myT.xml) files to VM code.")
+    parser.add_argument("input_path", help="a .jack or *_myT.xml file, or a directory containing them")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of worker processes (0 = one per CPU)")
+    parser.add_argument("--target", choices=("vm", "asm"), default="vm",
+                        help="vm: one .vm file per class (default); asm: one Hack .asm program with bootstrap, "
+                             "including any other .vm files in the input directory")
+    parser.add_argument("--stream", action="store_true", help="read tokens incrementally with a bounded lookahead buffer instead of loading the whole file")
+    parser.add_argument("--lookahead", type=int, default=256, help="token lookahead window used with --stream (default: 256)")
+    parser.add_argument("-O", "--opt-level", type=int, choices=(0, 1), default=0,
+                        help="expression optimization level: 0 = none, 1 = constant folding and strength reduction")
+    parser.add_argument("--strings", choices=("inline", "intern"), default="inline",
+                        help="string literals: 'inline' builds a new String at every evaluation (default); 'intern' builds each "
+                             "distinct literal once per class and reuses it, so code must not modify or dispose literal strings")
+    parser.add_argument("--cse", action="store_true",
+                        help="compute repeated subexpressions of a statement once (statements without calls only)")
+    parser.add_argument("--branch-layout", action="store_true",
+                        help="rotate while loops to test at the bottom and lower if statements with fewer jumps")
+    parser.add_argument("--array-stores", choices=("temp", "direct"), default="temp",
+                        help="a[i] = value: 'temp' parks the value in temp 0 while the address is set (default); 'direct' "
+                             "pushes a constant or variable value first and skips temp 0")
+    parser.add_argument("--labels", choices=("class", "subroutine"), default="class",
+                        help="label numbering: 'class' counts through the whole class (WHILE_EXP0, IF_FALSE_12, ...; default); "
+                             "'subroutine' restarts in every subroutine with short names (W0, IF1, ...), so editing one "
+                             "subroutine leaves the code of the others unchanged")
+    parser.add_argument("--peephole", nargs="?", const="all", metavar="RULES",
+                        help=f"run the peephole optimizer before saving; RULES is 'all' (default) or a comma separated subset of: {', '.join(peephole.RULES)}")
+    parser.add_argument("--max-errors", type=int, default=0, metavar="N",
+                        help="stop compiling a file after N errors (default: 0, no limit)")
+    parser.add_argument("--diagnostics", metavar="PATH",
+                        help="also write every error and warning to PATH as it is reported")
+    parser.add_argument("--diagnostics-format", choices=FORMATS, default="jsonl",
+                        help="format of --diagnostics: JSON Lines or SARIF 2.1.0 (default: jsonl)")
+    parser.add_argument("--stop-after", type=int, default=0, metavar="N",
+                        help="stop the build after the first N errors (default: 0, no limit)")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--stdout", action="store_true", help="write the VM code to stdout instead of .vm files (diagnostics go to stderr)")
+    output.add_argument("--bundle", metavar="PATH", help="write the VM code of all classes to one combined .vm file")
+    parser.add_argument("--whole-program", action="store_true",
+                        help=f"compile all classes before writing and drop functions not reachable from {' or '.join(whole_program.ENTRY_POINTS)}")
+    parser.add_argument("--inline", action="store_true",
+                        help="with --whole-program, replace calls to trivial getters and setters with direct field and static accesses")
+    parser.add_argument("--cache", action="store_true", help="skip token files whose content and .vm output are unchanged since the last cached build")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every compile_* method, token reader, symbol table and writer phase and print a summary")
+    parser.add_argument("--profile-json", metavar="PATH", help="save the profile summary as JSON (implies --profile)")
+    parser.add_argument("--profile-trace", metavar="PATH", help="save a Chrome trace-event file of every timed call (implies --profile)")
+    parser.add_argument("--cache-file", help=f"build cache location (default: <input dir>/{CACHE_FILE_NAME})")
+    parser.add_argument("--check-calls", action="store_true",
+                        help="check that every call names an existing subroutine of the right kind with the right number of "
+                             "arguments, using a class index kept between builds and the Jack OS API")
+    parser.add_argument("--class-index", metavar="PATH",
+                        help=f"class index location (implies --check-calls; default: <input dir>/{INDEX_FILE_NAME})")
+    server = parser.add_mutually_exclusive_group()
+    server.add_argument("--watch", action="store_true",
+                        help="keep running: recompile sources in input_path as they change and serve compile requests on --socket")
+    server.add_argument("--client", action="store_true",
+                        help="send input_path to a running --watch server instead of compiling here (the server's options apply)")
+    parser.add_argument("--socket", metavar="PATH", help=f"compile server socket (default: <input dir>/{compile_server.SOCKET_NAME})")
+    parser.add_argument("--poll-interval", type=float, default=compile_server.POLL_INTERVAL,
+                        help=f"seconds between change checks in --watch mode (default: {compile_server.POLL_INTERVAL})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    input_path = args.input_path
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    socket_path = args.socket or compile_server.default_socket_path(input_path)
+
+    if args.client:
+        compile_server.main([input_path, "--socket", socket_path])
+
+    try:
+        fileNames = collect_sources(input_path)
+    except ValueError as e:
+        print(e)
+        sys.exit(2)
+    try:
+        options = CompileOptions.from_args(args, in_memory=bool(args.stdout or args.bundle or args.whole_program or args.target == "asm"))
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(2)
+    if args.inline and not args.whole_program:
+        print("Error: --inline is a whole-program pass; use it together with --whole-program.")
         sys.exit(2)
+    if (args.stdout or args.bundle or args.whole_program or args.target == "asm") and (args.cache or args.cache_file):
+        print("Error: --cache needs per-file .vm output; it cannot be combined with --stdout, --bundle, --whole-program or --target asm.")
+        sys.exit(2)
+    if args.target == "asm" and args.bundle:
+        print("Error: --target asm always writes a single program; use --stdout or the default <input>.asm instead of --bundle.")
+        sys.exit(2)
+    if args.watch:
+        if (args.stdout or args.bundle or args.whole_program or args.cache or args.cache_file or args.target == "asm"
+                or options.check_calls):
+            print("Error: --watch recompiles files one at a time; it cannot be combined with --stdout, --bundle, --whole-program, "
+                  "--cache, --target asm or --check-calls.")
+            sys.exit(2)
+        if args.diagnostics or args.stop_after:
+            print("Error: --watch sends diagnostics to its clients; it cannot be combined with --diagnostics or --stop-after.")
+            sys.exit(2)
+        compiler = compile_server.CompileServer(input_path, options, compile_file, collect_sources, args.poll_interval)
+        try:
+            compile_server.serve(compiler, socket_path)
+        except (RuntimeError, OSError) as e:
+            print(f"Error: {e}")
+            sys.exit(2)
+        return
+    profile = ProfileReport() if options.profile else None
+    index = None
+    if options.check_calls:
+        index = ClassIndex(args.class_index or default_index_path(input_path))
+    with contextlib.ExitStack() as stack:
+        diagnostics = None
+        if args.diagnostics or args.stop_after:
+            stream = stack.enter_context(open(args.diagnostics, 'w')) if args.diagnostics else None
+            diagnostics = open_sink(args.diagnostics_format, stream, args.stop_after)
+            stack.callback(diagnostics.close)
+        prebuilt = []
+        roots = set()
+        if args.target == "asm" or args.whole_program:
+            try:
+                for path in prebuilt_vm_files(input_path, fileNames):
+                    with open(path) as f:
+                        prebuilt.append((path, f.read()))
+            except OSError as e:
+                print(f"Error in {path}: {e}")
+                sys.exit(2)
+            for _, text in prebuilt:
+                roots |= whole_program.call_targets(text)
+        if args.target == "asm":
+            asm = AsmSink()
+            try:
+                for path, text in prebuilt:
+                    asm.write(path, text)
+            except ValueError as e:
+                print(f"Error in {path}: {e}")
+                sys.exit(2)
+            if args.stdout:
+                stdout = sys.stdout
+                with contextlib.redirect_stdout(sys.stderr):
+                    build(fileNames, jobs, options, sink=asm, profile=profile, whole=args.whole_program, diagnostics=diagnostics,
+                          inline=args.inline, index=index, extra_roots=roots)
+                    asm.finish(stdout)
+            else:
+                build(fileNames, jobs, options, sink=asm, profile=profile, whole=args.whole_program, diagnostics=diagnostics,
+                      inline=args.inline, index=index, extra_roots=roots)
+                out = asm_output_path(input_path)
+                with open(out, 'w') as f:
+                    asm.finish(f)
+                print(f"[✓] Generated: {out}")
+        elif args.stdout:
+            # Keep stdout for the VM code only.
+            sink = BundleSink(sys.stdout)
+            with contextlib.redirect_stdout(sys.stderr):
+                build(fileNames, jobs, options, sink=sink, profile=profile, whole=args.whole_program, diagnostics=diagnostics,
+                      inline=args.inline, index=index, extra_roots=roots)
+        elif args.bundle:
+            with open(args.bundle, 'w') as bundle:
+                build(fileNames, jobs, options, sink=BundleSink(bundle), profile=profile, whole=args.whole_program,
+                      diagnostics=diagnostics, inline=args.inline, index=index, extra_roots=roots)
+            print(f"[✓] Generated: {args.bundle}")
+        else:
+            cache = None
+            if args.cache or args.cache_file:
+                cache = BuildCache(args.cache_file or default_cache_path(input_path), options.fingerprint())
+            build(fileNames, jobs, options, cache=cache, profile=profile, whole=args.whole_program, diagnostics=diagnostics,
+                  inline=args.inline, index=index, extra_roots=roots)
+    if args.profile_json:
+        profile.write_json(args.profile_json)
+    if args.profile_trace:
+        profile.write_trace(args.profile_trace)
+
+def check_calls(fileNames, index, diagnostics=None):
+    # One pass over the calls of every file against the class index, after
+    # all of them have been compiled or found up to date.
+    reporter = ErrorReporter(sink=diagnostics)
+    checked = index.check(fileNames, reporter)
+    if reporter.errors:
+        reporter.show()
+    print(f"[CALLS] Checked {checked} calls: {len(reporter.errors)} errors")
+    return len(reporter.errors)
+
+def build(fileNames, jobs, options, cache=None, sink=None, profile=None, whole=False, diagnostics=None, inline=False,
+          index=None, extra_roots=()):
     total_errors = 0
     total_warnings = 0
-    for f in fileNames:
-        print(f"[INFO] Compiling: {f}")
-        e,w = compile_one(f)
-        total_errors += e
-        total_warnings += w
+    processed = 0
+    program = ProgramSink(inline, extra_roots) if whole else None
+    try:
+        for e,w in compile_all(fileNames, jobs, cache, options, program or sink, profile, diagnostics, index):
+            total_errors += e
+            total_warnings += w
+            processed += 1
+    finally:
+        if cache is not None:
+            cache.save()
+        if index is not None:
+            index.save()
+    if diagnostics is not None and diagnostics.full():
+        print(f"[INFO] Stopped after {diagnostics.errors} errors (--stop-after); "
+              f"{len(fileNames) - processed} of {len(fileNames)} files not compiled.")
+    elif index is not None:
+        total_errors += check_calls(fileNames, index, diagnostics)
+    if program is not None:
+        program.finish(sink)
     print('[SUMMARY]')
-    print(f' Files processed: {len(fileNames)}')
+    print(f' Files processed: {processed}')
     print(f' Total errors: {total_errors}')
     print(f' Total warnings: {total_warnings}')
-    
+    if profile is not None:
+        profile.show()
+
 if __name__ == "__main__":
     main()
-    
\ No newline at end of file
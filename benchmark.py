@@ -0,0 +1,382 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+import tempfile
+from error_reporter import ErrorReporter
+from token_reader import TokenReader, StreamingTokenReader, write_token_file
+from jack_tokenizer import iter_jack_tokens
+from Jack_Compiler import compile_file
+from compile_options import CompileOptions
+from symbol_table import SymbolTable
+from vm_writer import VMWriter
+from compilation_engine import CompilationEngine
+import workload
+
+# Benchmarks for the compiler. Each measurement that reports peak memory runs
+# in a fresh interpreter so ru_maxrss reflects only that measurement.
+
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def _measure_reader(kind, path):
+    reporter = ErrorReporter()
+    start = time.perf_counter()
+    if kind == "stream":
+        tr = StreamingTokenReader(path, reporter)
+    else:
+        tr = TokenReader(path, reporter)
+    count = 0
+    while tr.advance() is not None:
+        count += 1
+    elapsed = time.perf_counter() - start
+    print(f"{count} {elapsed:.6f} {peak_rss_kb()}")
+
+def _run_measurement(*args):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "_measure", *args],
+                         check=True, capture_output=True, text=True).stdout.split()
+    return int(out[0]), float(out[1]), int(out[2])
+
+def _measure_suite(directory, repeat):
+    # Per-phase best-of-repeat times summed over every class in directory,
+    # printed as one JSON line for the parent process.
+    paths = sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.endswith("_myT.xml"))
+    phases = {"load": 0.0, "compile": 0.0, "save": 0.0}
+    tokens = lines = 0
+    for path in paths:
+        best = {}
+        for _ in range(repeat):
+            reporter = ErrorReporter()
+            start = time.perf_counter()
+            tr = TokenReader(path, reporter)
+            loaded = time.perf_counter()
+            vmw = VMWriter(path[:-8] + ".vm")
+            CompilationEngine(tr, vmw, SymbolTable(), reporter, path).compile_class()
+            compiled = time.perf_counter()
+            n = len(vmw)
+            vmw.save()
+            saved = time.perf_counter()
+            if reporter.errors:
+                raise SystemExit(f"{path}: {reporter.errors[0][2]}")
+            for phase, elapsed in (("load", loaded - start), ("compile", compiled - loaded), ("save", saved - compiled)):
+                best[phase] = min(best.get(phase, elapsed), elapsed)
+        for phase in phases:
+            phases[phase] += best[phase]
+        tokens += len(tr.tokens)
+        lines += n
+    print(json.dumps({"tokens": tokens, "vm_lines": lines, "phases": phases, "peak_rss_kb": peak_rss_kb()}))
+
+def _parse_sweeps(specs):
+    # ["depth=1,8,32", ...] -> [("depth", [1, 8, 32]), ...]
+    sweeps = []
+    for spec in specs:
+        axis, _, values = spec.partition("=")
+        if axis not in workload.Workload._fields or not values:
+            raise SystemExit(f"bad --sweep {spec!r}: expected AXIS=V1,V2,... with AXIS one of {', '.join(workload.Workload._fields)}")
+        sweeps.append((axis, [int(v) for v in values.split(",")]))
+    return sweeps
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench_suite(args):
+    # The base workload, then each --sweep axis varied on its own with the
+    # others held at their base values. Every point runs in a fresh process.
+    base = workload.Workload(args.classes, args.subroutines, args.statements, args.depth, args.string_length)
+    points = [base]
+    for axis, values in _parse_sweeps(args.sweep):
+        for value in values:
+            point = base._replace(**{axis: value})
+            if point not in points:
+                points.append(point)
+    results = []
+    print(f"{'workload':<36}{'tokens':>10}{'load s':>9}{'compile s':>11}{'save s':>9}{'tokens/s':>11}{'lines/s':>11}{'RSS MB':>9}")
+    for point in points:
+        with tempfile.TemporaryDirectory() as tmp:
+            workload.write_workload(tmp, point)
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), "_measure", "suite", tmp, str(args.repeat)],
+                                 check=True, capture_output=True, text=True).stdout
+        result = json.loads(out)
+        phases = result["phases"]
+        total = sum(phases.values())
+        result["workload"] = point._asdict()
+        result["tokens_per_sec"] = result["tokens"] / total
+        result["vm_lines_per_sec"] = result["vm_lines"] / (phases["compile"] + phases["save"])
+        results.append(result)
+        label = ",".join(f"{k}={v}" for k, v in zip("csndl", point))
+        print(f"{label:<36}{result['tokens']:>10}{phases['load']:>9.3f}{phases['compile']:>11.3f}{phases['save']:>9.3f}"
+              f"{result['tokens_per_sec']:>11.0f}{result['vm_lines_per_sec']:>11.0f}{result['peak_rss_kb'] / 1024:>9.1f}")
+    print("(c=classes s=subroutines n=statements d=depth l=string length)")
+    if args.json:
+        report = {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+
+def bench_compare(args):
+    # Matches workloads present in both reports and prints new/old ratios;
+    # above 1.0 is faster (throughput) or bigger (memory).
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    before = {tuple(r["workload"].values()): r for r in old["results"]}
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    print(f"{'workload':<36}{'tokens/s':>10}{'lines/s':>10}{'RSS':>8}")
+    for result in new["results"]:
+        key = tuple(result["workload"].values())
+        if key not in before:
+            continue
+        prev = before[key]
+        label = ",".join(f"{k}={v}" for k, v in zip("csndl", key))
+        print(f"{label:<36}{result['tokens_per_sec'] / prev['tokens_per_sec']:>10.2f}"
+              f"{result['vm_lines_per_sec'] / prev['vm_lines_per_sec']:>10.2f}"
+              f"{result['peak_rss_kb'] / prev['peak_rss_kb']:>8.2f}")
+
+def bench_memory(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "Big_myT.xml")
+        n = write_token_file(path, workload.class_tokens_of_size("Big", args.tokens))
+        size_mb = os.path.getsize(path) / 1e6
+        print(f"Token file: {n} tokens, {size_mb:.1f} MB")
+        print(f"{'reader':<10}{'tokens':>10}{'seconds':>10}{'tokens/s':>12}{'peak RSS MB':>14}")
+        for kind in ("list", "stream"):
+            count, elapsed, rss = _run_measurement("reader", kind, path)
+            print(f"{kind:<10}{count:>10}{elapsed:>10.2f}{count / elapsed:>12.0f}{rss / 1024:>14.1f}")
+
+def _best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_frontend(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        jack_path = os.path.join(tmp, "Big.jack")
+        xml_path = os.path.join(tmp, "Big_myT.xml")
+        n = workload.write_jack_file(jack_path, workload.class_tokens_of_size("Big", args.tokens))
+        print(f"Jack source: {n} tokens, {os.path.getsize(jack_path) / 1e6:.1f} MB")
+
+        def direct():
+            compile_file(jack_path)
+
+        def via_xml():
+            write_token_file(xml_path, iter_jack_tokens(jack_path, ErrorReporter()))
+            compile_file(xml_path)
+
+        t_direct = _best_of(args.repeat, direct)
+        t_xml = _best_of(args.repeat, via_xml)
+        print(f"{'pipeline':<22}{'seconds':>10}{'tokens/s':>12}")
+        print(f"{'.jack -> VM':<22}{t_direct:>10.2f}{n / t_direct:>12.0f}")
+        print(f"{'.jack -> XML -> VM':<22}{t_xml:>10.2f}{n / t_xml:>12.0f}")
+        print(f"speedup: {t_xml / t_direct:.2f}x")
+
+def bench_codegen(args):
+    # Code generation only: tokens are loaded up front, then the engine and
+    # the writer run against a throwaway output file.
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "Big_myT.xml")
+        write_token_file(path, workload.class_tokens_of_size("Big", args.tokens))
+        tr = TokenReader(path, ErrorReporter())
+        out = os.path.join(tmp, "Big.vm")
+        codegen_times, save_times = [], []
+        for _ in range(args.repeat):
+            tr.reset()
+            vmw = VMWriter(out)
+            engine = CompilationEngine(tr, vmw, SymbolTable(), ErrorReporter(), path)
+            start = time.perf_counter()
+            engine.compile_class()
+            middle = time.perf_counter()
+            n = len(vmw)
+            vmw.save()
+            codegen_times.append(middle - start)
+            save_times.append(time.perf_counter() - middle)
+        codegen, save = min(codegen_times), min(save_times)
+        print(f"{len(tr.tokens)} tokens -> {n} VM instructions")
+        print(f"{'phase':<10}{'seconds':>10}{'instructions/s':>16}")
+        print(f"{'codegen':<10}{codegen:>10.3f}{n / codegen:>16.0f}")
+        print(f"{'save':<10}{save:>10.3f}{n / save:>16.0f}")
+
+def bench_symbols(args):
+    # Identifier resolution in isolation, then code generation for a class
+    # where every statement references five variables.
+    st = SymbolTable()
+    for i in range(8):
+        st.define(f"s{i}", "int", "static")
+        st.define(f"f{i}", "int", "field")
+    st.start_subroutine()
+    for i in range(4):
+        st.define(f"a{i}", "int", "arg")
+    for i in range(12):
+        st.define(f"v{i}", "Array", "var")
+    names = [n for prefix, count in (("s", 8), ("f", 8), ("a", 4), ("v", 12)) for n in (f"{prefix}{i}" for i in range(count))]
+    names = (names * (args.lookups // len(names) + 1))[:args.lookups]
+
+    def three_calls():
+        for name in names:
+            st.kind_of(name)
+            st.index_of(name)
+            st.type_of(name)
+
+    def resolve():
+        for name in names:
+            st.resolve(name)
+
+    t_calls = _best_of(args.repeat, three_calls)
+    t_resolve = _best_of(args.repeat, resolve)
+    print(f"{'lookup':<26}{'seconds':>10}{'lookups/s':>14}")
+    print(f"{'kind_of+index_of+type_of':<26}{t_calls:>10.3f}{len(names) / t_calls:>14.0f}")
+    print(f"{'resolve':<26}{t_resolve:>10.3f}{len(names) / t_resolve:>14.0f}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "Ids_myT.xml")
+        write_token_file(path, workload.class_tokens_of_size("Ids", args.tokens))
+        tr = TokenReader(path, ErrorReporter())
+
+        def codegen():
+            tr.reset()
+            CompilationEngine(tr, VMWriter(os.path.join(tmp, "Ids.vm")), SymbolTable(), ErrorReporter(), path).compile_class()
+
+        t_codegen = _best_of(args.repeat, codegen)
+        print(f"codegen: {len(tr.tokens)} tokens in {t_codegen:.3f}s ({len(tr.tokens) / t_codegen:.0f} tokens/s)")
+
+def bench_strings(args):
+    # Generated size and String.* calls for the inline and intern literal
+    # strategies on a class that prints a literal in every statement.
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "Strings_myT.xml")
+        n = write_token_file(path, workload.class_tokens("Strings", args.subroutines, args.statements, 1, args.length))
+        literals = args.subroutines * args.statements
+        print(f"{n} tokens, {literals} literal uses of {args.length} characters")
+        print(f"{'strategy':<10}{'instructions':>14}{'bytes':>10}{'codegen s':>11}{'String calls/use':>18}")
+        for strategy in ("inline", "intern"):
+            options = CompileOptions(in_memory=True, strings=strategy)
+            start = time.perf_counter()
+            text = compile_file(path, options).text
+            elapsed = time.perf_counter() - start
+            lines = text.splitlines()
+            # Calls a use site makes each time it runs: 1 + length inline; one
+            # helper call once interned (the first run also builds it).
+            per_use = 1 + args.length if strategy == "inline" else 1
+            print(f"{strategy:<10}{len(lines):>14}{len(text):>10}{elapsed:>11.3f}{per_use:>18}")
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples", "arrays")
+
+def _vm_instructions(paths, array_stores):
+    total = 0
+    for path in paths:
+        result = compile_file(path, CompileOptions(in_memory=True, array_stores=array_stores))
+        if result.reporter.errors:
+            raise SystemExit(f"{path}: {result.reporter.errors[0][2]}")
+        total += len(result.text.splitlines())
+    return total
+
+def bench_arrays(args):
+    # VM instruction counts with the temp and direct array store lowerings,
+    # on a generated array-heavy class and on the .jack files in --sample.
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "Arrays_myT.xml")
+        n = write_token_file(path, workload.array_class_tokens("Arrays", args.copies))
+        programs = [(f"generated ({n} tokens)", [path])]
+        if args.sample and os.path.isdir(args.sample):
+            sources = sorted(os.path.join(args.sample, f) for f in os.listdir(args.sample) if f.endswith(".jack"))
+            programs.append((os.path.basename(os.path.normpath(args.sample)), sources))
+        print(f"{'program':<28}{'temp':>10}{'direct':>10}{'saved':>10}")
+        for name, paths in programs:
+            temp = _vm_instructions(paths, "temp")
+            direct = _vm_instructions(paths, "direct")
+            print(f"{name:<28}{temp:>10}{direct:>10}{temp - direct:>10}")
+
+def bench_depth(args):
+    # Stress test: one expression nested --depth levels in each shape,
+    # compiled at -O0 and -O1. Fails if any compile reports an error.
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'shape':<8}{'depth':>9}{'tokens':>10}{'-O':>4}{'seconds':>10}{'instructions':>14}")
+        for shape in args.shape or workload.NESTING_SHAPES:
+            path = os.path.join(tmp, "Main_myT.xml")
+            n = write_token_file(path, workload.nested_class_tokens("Main", shape, args.depth))
+            for level in (0, 1):
+                start = time.perf_counter()
+                result = compile_file(path, CompileOptions(opt_level=level, in_memory=True))
+                elapsed = time.perf_counter() - start
+                if result.reporter.errors:
+                    raise SystemExit(f"{shape}: {result.reporter.errors[0][2]}")
+                print(f"{shape:<8}{args.depth:>9}{n:>10}{level:>4}{elapsed:>10.2f}{len(result.text.splitlines()):>14}")
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "_measure":
+        if argv[1] == "reader":
+            _measure_reader(argv[2], argv[3])
+        elif argv[1] == "suite":
+            _measure_suite(argv[2], int(argv[3]))
+        return
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="Compiler benchmarks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("memory", help="peak memory of the list and streaming token readers")
+    p.add_argument("--tokens", type=int, default=1_000_000)
+    p.set_defaults(func=bench_memory)
+    p = sub.add_parser("frontend", help="end-to-end .jack -> VM against .jack -> XML -> VM")
+    p.add_argument("--tokens", type=int, default=200_000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_frontend)
+    p = sub.add_parser("codegen", help="CompilationEngine + VMWriter throughput on one large class")
+    p.add_argument("--tokens", type=int, default=500_000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_codegen)
+    p = sub.add_parser("symbols", help="SymbolTable.resolve against separate kind_of/index_of/type_of lookups")
+    p.add_argument("--lookups", type=int, default=1_000_000)
+    p.add_argument("--tokens", type=int, default=300_000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.set_defaults(func=bench_symbols)
+    p = sub.add_parser("strings", help="inline against interned string literals on a string-heavy class")
+    p.add_argument("--subroutines", type=int, default=20)
+    p.add_argument("--statements", type=int, default=50)
+    p.add_argument("--length", type=int, default=40, help="literal length")
+    p.set_defaults(func=bench_strings)
+    p = sub.add_parser("arrays", help="VM instruction counts with --array-stores temp and direct on array-heavy code")
+    p.add_argument("--copies", type=int, default=10, help="copies of the fill/copy/sort/clear subroutines")
+    p.add_argument("--sample", default=SAMPLE_DIR, help="also compare the .jack files in this directory (default: samples/arrays)")
+    p.set_defaults(func=bench_arrays)
+    p = sub.add_parser("depth", help="compile expressions nested --depth levels deep (stress test for the expression compiler)")
+    p.add_argument("--depth", type=int, default=100_000)
+    p.add_argument("--shape", action="append", choices=workload.NESTING_SHAPES, help="nesting shape (default: all)")
+    p.set_defaults(func=bench_depth)
+    p = sub.add_parser("suite", help="per-phase throughput and peak RSS over synthetic workloads, optionally saved as JSON")
+    base = workload.DEFAULT_WORKLOAD
+    p.add_argument("--classes", type=int, default=base.classes)
+    p.add_argument("--subroutines", type=int, default=base.subroutines, help="subroutines per class")
+    p.add_argument("--statements", type=int, default=base.statements, help="statements per subroutine")
+    p.add_argument("--depth", type=int, default=base.depth, help="expression nesting depth")
+    p.add_argument("--string-length", type=int, default=base.string_length, help="string literal length (0 = no strings)")
+    p.add_argument("--sweep", action="append", default=[], metavar="AXIS=V1,V2,...",
+                   help=f"also run the base workload with AXIS set to each value; AXIS is one of {', '.join(base._fields)}")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--json", metavar="PATH", help="save the results as JSON for later comparison")
+    p.set_defaults(func=bench_suite)
+    p = sub.add_parser("compare", help="compare two JSON reports from `suite --json`")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.set_defaults(func=bench_compare)
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
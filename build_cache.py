@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+from error_reporter import ErrorReporter
+
+# Bump when the generated code changes in a way the module hash below would
+# not catch (e.g. a different OS calling convention).
+COMPILER_VERSION = "1.0"
+CACHE_FILE_NAME = ".jack_build_cache.json"
+
+_fingerprint = None
+
+def compiler_fingerprint():
+    # The version string plus a hash of the compiler's own modules, so editing
+    # the compiler invalidates every cached entry without a manual bump.
+    global _fingerprint
+    if _fingerprint is None:
+        h = hashlib.sha256(COMPILER_VERSION.encode())
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(here)):
+            if name.endswith(".py"):
+                with open(os.path.join(here, name), 'rb') as f:
+                    h.update(name.encode())
+                    h.update(f.read())
+        _fingerprint = f"{COMPILER_VERSION}-{h.hexdigest()[:16]}"
+    return _fingerprint
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+def default_cache_path(input_path):
+    directory = input_path if os.path.isdir(input_path) else os.path.dirname(input_path)
+    return os.path.join(directory, CACHE_FILE_NAME)
+
+class BuildCache:
+    def __init__(self, cache_path, options_fingerprint=""):
+        self.cache_path = cache_path
+        self.base_dir = os.path.dirname(os.path.abspath(cache_path))
+        self.version = f"{compiler_fingerprint()};{options_fingerprint}"
+        self.entries = {}
+        self.digests = {}
+        self.dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != self.version:
+            self.dirty = True
+            return
+        self.entries = data.get("entries", {})
+        self.evict_missing()
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.base_dir)
+
+    def evict_missing(self):
+        for key in list(self.entries):
+            if not os.path.exists(os.path.join(self.base_dir, key)):
+                del self.entries[key]
+                self.dirty = True
+
+    def lookup(self, path, out_path):
+        # Returns a replay ErrorReporter when the token file and its output are
+        # unchanged since the last build, otherwise None.
+        try:
+            digest = file_digest(path)
+        except OSError:
+            return None
+        self.digests[path] = digest
+        entry = self.entries.get(self._key(path))
+        if entry is None or entry["digest"] != digest:
+            return None
+        try:
+            st = os.stat(out_path)
+        except OSError:
+            return None
+        if [st.st_size, st.st_mtime_ns] != entry["output"]:
+            return None
+        reporter = ErrorReporter()
+        for token_number, message, code in entry["errors"]:
+            reporter.add_error(path, token_number, message, code)
+        for token_number, message, code in entry["warnings"]:
+            reporter.add_warning(path, token_number, message, code)
+        for message in entry.get("notes", ()):
+            reporter.add_note(path, message)
+        return reporter
+
+    def store(self, path, out_path, reporter):
+        digest = self.digests.pop(path, None) or file_digest(path)
+        try:
+            st = os.stat(out_path)
+        except OSError:
+            return
+        self.entries[self._key(path)] = {
+            "digest": digest,
+            "output": [st.st_size, st.st_mtime_ns],
+            "errors": [[t, m, c] for _, t, m, c in reporter.errors],
+            "warnings": [[t, m, c] for _, t, m, c in reporter.warnings],
+            "notes": [m for _, m in reporter.notes],
+        }
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": self.version, "entries": self.entries}, f)
+        os.replace(tmp_path, self.cache_path)
+        self.dirty = False
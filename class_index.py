@@ -0,0 +1,152 @@
+import os
+import json
+from error_reporter import UNDEFINED_SUBROUTINE, CALL_MISMATCH
+
+# Persistent index of class signatures: for every compiled class, the kind
+# and parameter count of each subroutine plus the calls its source makes.
+# Each file's entry is replaced when that file is compiled, so a build can
+# check every call in the program against the index without re-parsing the
+# classes it did not compile this time (cached files, or the rest of the
+# directory when only one file is given).
+
+INDEX_VERSION = 1
+INDEX_FILE_NAME = ".jack_class_index.json"
+
+def _os_class(functions="", methods="", constructors=""):
+    # "name/parameters ..." per kind.
+    table = {}
+    for kind, spec in (("function", functions), ("method", methods), ("constructor", constructors)):
+        for item in spec.split():
+            name, n_params = item.split("/")
+            table[name] = (kind, int(n_params))
+    return table
+
+# The standard Jack OS API. A class of the same name in the program replaces
+# the table entry.
+OS_CLASSES = {
+    "Math": _os_class("init/0 abs/1 multiply/2 divide/2 min/2 max/2 sqrt/1"),
+    "String": _os_class("backSpace/0 doubleQuote/0 newLine/0",
+                        "dispose/0 length/0 charAt/1 setCharAt/2 appendChar/1 eraseLastChar/0 intValue/0 setInt/1",
+                        "new/1"),
+    "Array": _os_class("new/1", "dispose/0"),
+    "Output": _os_class("init/0 moveCursor/2 printChar/1 printString/1 printInt/1 println/0 backSpace/0"),
+    "Screen": _os_class("init/0 clearScreen/0 setColor/1 drawPixel/2 drawLine/4 drawRectangle/4 drawCircle/3"),
+    "Keyboard": _os_class("init/0 keyPressed/0 readChar/0 readLine/1 readInt/1"),
+    "Memory": _os_class("init/0 peek/1 poke/2 alloc/1 deAlloc/1"),
+    "Sys": _os_class("init/0 halt/0 error/1 wait/1"),
+}
+
+def default_index_path(input_path):
+    directory = input_path if os.path.isdir(input_path) else os.path.dirname(input_path)
+    return os.path.join(directory, INDEX_FILE_NAME)
+
+class ClassIndex:
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.base_dir = os.path.dirname(os.path.abspath(index_path))
+        self.dirty = False
+        # Read on first use, see entries.
+        self._entries = None
+
+    @property
+    def entries(self):
+        # key -> {"class", "source": [size, mtime_ns], "errors",
+        # "subroutines": {name: [kind, n_params]},
+        # "calls": [[token, callee, n_args, on_object], ...]}
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self.index_path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                return self._entries
+            if data.get("version") != INDEX_VERSION:
+                self.dirty = True
+                return self._entries
+            self._entries = data.get("classes", {})
+            for key in list(self._entries):
+                if not os.path.exists(os.path.join(self.base_dir, key)):
+                    del self._entries[key]
+                    self.dirty = True
+        return self._entries
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.base_dir)
+
+    def _stamp(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def is_current(self, path):
+        # True when path has an entry and has not changed since.
+        entry = self.entries.get(self._key(path))
+        return entry is not None and entry["source"] == self._stamp(path)
+
+    def update(self, path, class_name, subroutines, calls, errors=False):
+        # A class lives in one file: an entry for the same class from another
+        # file (say its token file, now compiled from source) is dropped.
+        key = self._key(path)
+        entries = self.entries
+        for other in [k for k, e in entries.items() if e["class"] == class_name and k != key]:
+            del entries[other]
+        entries[key] = {
+            "class": class_name,
+            "source": self._stamp(path),
+            "errors": errors,
+            "subroutines": {name: list(signature) for name, signature in subroutines.items()},
+            "calls": [list(call) for call in calls],
+        }
+        self.dirty = True
+
+    def check(self, paths, reporter):
+        # Checks the calls made by paths against the index and the OS table;
+        # returns the number of calls checked. Calls to classes the index
+        # does not know (e.g. prebuilt .vm files) are not checked. Classes
+        # that failed to compile are skipped both ways, since their
+        # signatures and calls may be incomplete.
+        classes = dict(OS_CLASSES)
+        broken = set()
+        for entry in self.entries.values():
+            classes[entry["class"]] = entry["subroutines"]
+            if entry["errors"]:
+                broken.add(entry["class"])
+        checked = 0
+        for path in paths:
+            entry = self.entries.get(self._key(path))
+            if entry is None or entry["errors"]:
+                continue
+            for token_number, callee, n_args, on_object in entry["calls"]:
+                class_name, _, name = callee.partition(".")
+                subroutines = classes.get(class_name)
+                if subroutines is None or class_name in broken:
+                    continue
+                checked += 1
+                signature = subroutines.get(name)
+                if signature is None:
+                    reporter.add_error(path, token_number, f"Class '{class_name}' has no subroutine '{name}'.",
+                                       UNDEFINED_SUBROUTINE)
+                    continue
+                kind, n_params = signature
+                if on_object and kind != "method":
+                    reporter.add_error(path, token_number, f"'{callee}' is a {kind}, not a method; call it as {callee}().",
+                                       CALL_MISMATCH)
+                elif not on_object and kind == "method":
+                    reporter.add_error(path, token_number, f"'{callee}' is a method; call it on a {class_name} object.",
+                                       CALL_MISMATCH)
+                elif n_args != n_params:
+                    plural = "" if n_params == 1 else "s"
+                    reporter.add_error(path, token_number,
+                                       f"'{callee}' takes {n_params} argument{plural} but is called with {n_args}.", CALL_MISMATCH)
+        return checked
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"version": INDEX_VERSION, "classes": self.entries}, f)
+        os.replace(tmp_path, self.index_path)
+        self.dirty = False
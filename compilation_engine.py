@@ -2,65 +2,167 @@ from token_reader import Token as TRToken
 from token_reader import TokenReader
 from symbol_table import SymbolTable
 from vm_writer import VMWriter
-from error_reporter import ErrorReporter
+from error_reporter import ErrorReporter, INPUT_ERROR, SYNTAX_ERROR, UNEXPECTED_TOKEN, UNEXPECTED_EOF, UNDEFINED_VARIABLE, INVALID_TYPE, INVALID_CONSTANT, UNKNOWN_OPERATOR
+from expression_tree import Const, Var, Str, ArrayRead, Unary, Binary, Call, Double, EMPTY, fold, has_call, common_subexpressions, is_boolean, invert_relation
+
+_BINARY_OPS = frozenset("+-*/&|<>=")
+
+# Frames on the expression parser's stack (see CompilationEngine._parse):
+# [_EXPR, op, left]               binary operator chain, op/left are pending
+# [_PAREN]                        waiting for ')'
+# [_UNARY, op]
+# [_INDEX, identifier token]      waiting for ']'
+# [_ARGS, name, receiver, args, token index]   subroutine call arguments
+_EXPR, _PAREN, _UNARY, _INDEX, _ARGS = range(5)
+
+# Where panic-mode recovery (CompilationEngine._synchronize) stops skipping
+# inside a subroutine body and in the class body.
+_STATEMENT_KEYWORDS = ("let", "if", "while", "do", "return")
+_MEMBER_KEYWORDS = ("static", "field", "constructor", "function", "method")
+_STATEMENT_STOPS = frozenset(_STATEMENT_KEYWORDS + ("var",) + _MEMBER_KEYWORDS)
+_MEMBER_STOPS = frozenset(_MEMBER_KEYWORDS)
+
+# Temp slots for common subexpressions: temp 0 is the array store scratch
+# and temp 1 the doubling scratch.
+CSE_FIRST_TEMP = 2
+CSE_LAST_TEMP = 7
+
+# Label prefixes with --labels subroutine.
+_SHORT_LABELS = {"WHILE_EXP": "W", "WHILE_END": "WE", "WHILE_BODY": "WB", "IF_TRUE_": "IT", "IF_FALSE_": "IF", "IF_END_": "IE"}
 
 class LabelGenerator:
-    def __init__(self):
+    # With scope "class" one counter numbers every label of the class, so an
+    # edit renumbers all the labels after it. With "subroutine" the counter
+    # restarts in each subroutine (VM labels are local to their function)
+    # and the prefixes are short: unchanged subroutines compile to the same
+    # code whatever happens elsewhere in the class.
+    def __init__(self, scope="class"):
         self.count = 0
+        self.scope = scope
+
+    def start_subroutine(self):
+        if self.scope == "subroutine":
+            self.count = 0
 
     def generate(self, prefix):
+        if self.scope == "subroutine":
+            prefix = _SHORT_LABELS.get(prefix, prefix)
         label = f"{prefix}{self.count}"
         self.count += 1
         return label
     
 class CompilationEngine:
-    def __init__(self, token_reader: TokenReader, vm_writer: VMWriter, symbol_table: SymbolTable, error_reporter: ErrorReporter, file_name: str):
+    def __init__(self, token_reader: TokenReader, vm_writer: VMWriter, symbol_table: SymbolTable, error_reporter: ErrorReporter, file_name: str, opt_level: int = 0, strings: str = "inline", cse: bool = False, branch_layout: bool = False, array_stores: str = "temp", labels: str = "class"):
         self.tr = token_reader
         self.vm = vm_writer
         self.st = symbol_table
         self.er = error_reporter
         self.file_name = file_name
         self.class_name = None
-        self.label_gen = LabelGenerator()
+        self.label_gen = LabelGenerator(labels)
+        self.opt_level = opt_level
+        # "inline" builds every string literal where it is used; "intern"
+        # calls a per-literal helper that builds it once (see
+        # _write_string_helpers).
+        self.strings = strings
+        self.string_helpers = {}
+        # Reuse repeated side-effect free subexpressions of a statement from
+        # temp slots (see _begin_statement).
+        self.cse = cse
+        self._cse = None
+        self.cse_reused = 0
+        self.cse_loads_eliminated = 0
+        # Lower if/while with fewer jumps (see _compile_while_layout and
+        # _compile_if_layout).
+        self.branch_layout = branch_layout
+        # "temp" stores a[i] = value through temp 0; "direct" pushes a simple
+        # value before the address when that cannot change the result (see
+        # _stores_directly).
+        self.array_stores = array_stores
+        self.array_store_count = 0
+        self.direct_array_stores = 0
+        # What a class index (see class_index.py) needs from this class:
+        # name -> (kind, parameter count) of every subroutine, and
+        # (token index, callee, argument count, called on an object) of
+        # every call written in the source.
+        self.subroutines = {}
+        self.calls = []
+        # Set by a syntax error; errors are not reported until _synchronize
+        # has skipped to the next statement or declaration.
+        self.panicking = False
 
     def _peek(self):
         return self.tr.peek()
     
     def _advance(self, expected_tag = None, expected_value = None):
-        token = self.tr.advance()
+        # An unexpected token is left in place, so a missing token does not
+        # also swallow the start of the next statement.
+        token = self.tr.peek()
         if token is None:
-            self.er.add_error(self.file_name, self.tr.current_index, f"Unexpected end of file. Expected {expected_value or expected_tag}.")
+            self._syntax_error(self.tr.current_index, f"Unexpected end of file. Expected {expected_value or expected_tag}.", UNEXPECTED_EOF)
             return None
         if expected_tag and token.tag != expected_tag:
-            self.er.add_error(self.file_name, token.index, f"Expected token tag {expected_tag}, but got {token.tag}.")
+            self._syntax_error(token.index, f"Expected token tag {expected_tag}, but got {token.tag}.")
             return None
         if expected_value and token.value != expected_value:
-            self.er.add_error(self.file_name, token.index, f"Expected token value '{expected_value}', but got '{token.value}'.")
+            self._syntax_error(token.index, f"Expected token value '{expected_value}', but got '{token.value}'.")
             return None
-        return token
+        return self.tr.advance()
+
+    def _error(self, token_number, message, code=SYNTAX_ERROR):
+        if not self.panicking:
+            self.er.add_error(self.file_name, token_number, message, code)
+
+    def _syntax_error(self, token_number, message, code=SYNTAX_ERROR):
+        self._error(token_number, message, code)
+        self.panicking = True
+
+    def _synchronize(self, stop_keywords):
+        # Panic-mode recovery: skips the rest of the broken statement or
+        # declaration. A ';' is consumed; a '}' closing the enclosing block
+        # or a keyword in stop_keywords is left for the caller. Blocks opened
+        # while skipping are skipped whole.
+        depth = 0
+        token = self.tr.peek()
+        while token is not None:
+            if token.tag == "symbol":
+                if token.value == "{":
+                    depth += 1
+                elif token.value == "}":
+                    if not depth:
+                        break
+                    depth -= 1
+                elif token.value == ";" and not depth:
+                    self.tr.advance()
+                    break
+            elif not depth and token.tag == "keyword" and token.value in stop_keywords:
+                break
+            self.tr.advance()
+            token = self.tr.peek()
+        self.panicking = False
     
     def compile_class(self):
         token = self._peek()
         if token is None:
-            self.er.add_error(self.file_name, 0, "No tokens to compile.")
+            self._error(0, "No tokens to compile.", INPUT_ERROR)
             return
         if token.tag != "keyword" or token.value != "class":
-            self.er.add_error(self.file_name, token.index, f"Expected 'class' keyword at the beginning of class declaration but got '{token.value}'.")
+            self._error(token.index, f"Expected 'class' keyword at the beginning of class declaration but got '{token.value}'.")
         
         self._advance("keyword", "class")
         class_name_token = self._advance("identifier")
         if class_name_token is None:
-            self.er.add_error(self.file_name, 0, "Class name expected after 'class' keyword.")
+            self._error(0, "Class name expected after 'class' keyword.")
             self.class_name = "Unknown"
         else:
             self.class_name = class_name_token.value
 
         self._advance("symbol", "{")
 
-        while True:
+        while not self.er.truncated:
             token = self._peek()
             if token is None:
-                self.er.add_error(self.file_name, 0, "Unexpected end of file in class body.")
+                self._error(0, "Unexpected end of file in class body.", UNEXPECTED_EOF)
                 break
             if token.tag == "symbol" and token.value == "}":
                 break
@@ -69,8 +171,10 @@ class CompilationEngine:
             elif token.tag == "keyword" and token.value in ("constructor", "function", "method"):
                 self.compile_subroutine()
             else:
-                self.er.add_error(self.file_name, token.index, f"Unexpected token in class body: {token.value}")
-                self._advance()
+                self._syntax_error(token.index, f"Unexpected token in class body: {token.value}", UNEXPECTED_TOKEN)
+            if self.panicking:
+                self._synchronize(_MEMBER_STOPS)
+        self._write_string_helpers()
 
     def compile_class_var_dec(self):
         kind_token = self._advance("keyword")
@@ -78,16 +182,15 @@ class CompilationEngine:
         type_token = self._advance()
 
         if not type_token:
-            self.er.add_error(self.file_name, 0, "Type expected in class variable declaration.")
-
-        if type_token.tag not in ("keyword", "identifier"):
-            self.er.add_error(self.file_name, type_token.index, f"Invalid type '{type_token.value}' in class variable declaration.")
+            self._error(0, "Type expected in class variable declaration.")
+        elif type_token.tag not in ("keyword", "identifier"):
+            self._error(type_token.index, f"Invalid type '{type_token.value}' in class variable declaration.", INVALID_TYPE)
 
         type_name = type_token.value if type_token else "int"
         name_token = self._advance("identifier")
 
         if name_token is None:
-            self.er.add_error(self.file_name, 0, "Variable name expected in class variable declaration.")
+            self._error(0, "Variable name expected in class variable declaration.")
         else:
             self.st.define(name_token.value, type_name, "field" if kind == "field" else "static")
 
@@ -95,7 +198,7 @@ class CompilationEngine:
             self._advance("symbol", ",")
             name = self._advance("identifier")
             if name is None:
-                self.er.add_error(self.file_name, 0, "Variable name expected after ','.")
+                self._error(0, "Variable name expected after ','.")
             else:
                 self.st.define(name.value, type_name, "field" if kind == "field" else "static")
         self._advance("symbol", ";")
@@ -105,27 +208,32 @@ class CompilationEngine:
         subr_type = subr_token.value if subr_token else "function"
         return_type_token = self._advance()
         if return_type_token is None:
-            self.er.add_error(self.file_name, 0, "Return type expected in subroutine declaration.")
+            self._error(0, "Return type expected in subroutine declaration.")
         return_type = return_type_token.value if return_type_token else "void"
         name_token = self._advance("identifier")
         if name_token is None:
-            self.er.add_error(self.file_name, 0, "Subroutine name expected in subroutine declaration.")
+            self._error(0, "Subroutine name expected in subroutine declaration.")
             subr_name = "unknown"
         else:
             subr_name = name_token.value
         full_subr_name = f"{self.class_name}.{subr_name}"
 
         self.st.start_subroutine()
+        self.label_gen.start_subroutine()
         if subr_type == "method":
             self.st.define("this", self.class_name, "arg")
         self._advance("symbol", "(")
         self.compile_parameter_list()
         self._advance("symbol", ")")
+        n_params = self.st.var_count("arg") - (1 if subr_type == "method" else 0)
+        self.subroutines.setdefault(subr_name, (subr_type, n_params))
 
         self._advance("symbol", "{")
 
         while self._peek() and self._peek().tag == "keyword" and self._peek().value == "var":
             self.compile_var_dec()
+            if self.panicking:
+                self._synchronize(_STATEMENT_STOPS)
 
         n_locals = self.st.var_count("var")
         self.vm.write_function(full_subr_name, n_locals)
@@ -148,13 +256,15 @@ class CompilationEngine:
         while True:
             type_token = self._advance()
             if type_token is None:
-                self.er.add_error(self.file_name, 0, "Type expected in parameter list.")
+                self._error(0, "Type expected in parameter list.")
+                break
             if type_token.tag not in ('keyword','identifier'):
-                self.er.add_error(self.file_name, type_token.index, f"Invalid type '{type_token.value}' in parameter list.")
+                self._error(type_token.index, f"Invalid type '{type_token.value}' in parameter list.", INVALID_TYPE)
             name_token = self._advance("identifier")
             if name_token is None:
-                self.er.add_error(self.file_name, 0, "Parameter name expected in parameter list.")
-            self.st.define(name_token.value, type_token.value, "arg")
+                self._error(0, "Parameter name expected in parameter list.")
+            else:
+                self.st.define(name_token.value, type_token.value, "arg")
             if self._peek() and self._peek().tag == "symbol" and self._peek().value == ",":
                 self._advance("symbol", ",")
             else:
@@ -166,21 +276,36 @@ class CompilationEngine:
         type_name = type_token.value if type_token else "int"
         name = self._advance("identifier")
         if name is None:
-            self.er.add_error(self.file_name, 0, "Variable name expected in variable declaration.")
+            self._error(0, "Variable name expected in variable declaration.")
         else:
             self.st.define(name.value, type_name, "var")
         while self._peek() and self._peek().tag == "symbol" and self._peek().value == ",":
             self._advance("symbol", ",")
             name = self._advance("identifier")
             if name is None:
-                self.er.add_error(self.file_name, 0, "Variable name expected after ','.")
+                self._error(0, "Variable name expected after ','.")
             else:
                 self.st.define(name.value, type_name, "var")
         self._advance("symbol", ";")
 
     def compile_statements(self):
-        while self._peek() and self._peek().tag == "keyword" and self._peek().value in ("let", "if", "while", "do", "return"):
+        while not self.er.truncated:
+            if self.panicking:
+                self._synchronize(_STATEMENT_STOPS)
             token = self._peek()
+            if token is None or (token.tag == "symbol" and token.value == "}"):
+                break
+            if token.tag != "keyword" or token.value not in _STATEMENT_KEYWORDS:
+                # A member keyword means the body's '}' is missing; the
+                # caller reports that.
+                if token.tag == "keyword" and token.value in _MEMBER_KEYWORDS:
+                    break
+                self._syntax_error(token.index, f"Expected a statement but got '{token.value}'.", UNEXPECTED_TOKEN)
+                if token.tag == "keyword" and token.value in _STATEMENT_STOPS:
+                    # A misplaced 'var' would stop the skipping right here.
+                    self.tr.advance()
+                self._synchronize(_STATEMENT_STOPS)
+                continue
             if token.value == "let":
                 self.compile_let()
             elif token.value == "if":
@@ -202,47 +327,79 @@ class CompilationEngine:
         self._advance("keyword", "let")
         var_name_token = self._advance("identifier")
         if var_name_token is None:
-            self.er.add_error(self.file_name, 0, "Variable name expected in let statement.")
+            self._error(0, "Variable name expected in let statement.")
             return
         var_name = var_name_token.value
-        is_array = False
+        index_node = None
         if self._peek() and self._peek().tag == "symbol" and self._peek().value == "[":
-            is_array = True
             self._advance("symbol", "[")
-            self.compile_expression()
+            index_node = self._prepare(self.parse_expression())
             self._advance("symbol", "]")
-            kind = self.st.kind_of(var_name)
-            index = self.st.index_of(var_name)
-            if kind is None or index is None:
-                self.er.add_error(self.file_name, var_name_token.index, f"Undefined variable '{var_name}' in let statement.")
-                seg = 'local'
-                index = 0
-            else:
-                seg = self._kind_to_segment(kind)
-            self.vm.write_push(seg, index)
-            self.vm.write_arithmetic("add")
+            base = self.st.resolve(var_name)
+            if base is None:
+                self._error(var_name_token.index, f"Undefined variable '{var_name}' in let statement.", UNDEFINED_VARIABLE)
+                base = Var('local', 0)
         self._advance("symbol", "=")
-        self.compile_expression()
+        value = self._prepare(self.parse_expression())
         self._advance("symbol", ";")
-        if is_array:
+        if index_node is not None:
+            self.array_store_count += 1
+        # Both expressions are parsed before either is emitted so that they
+        # can share subexpressions.
+        if index_node is not None and self._stores_directly(index_node, value):
+            self._begin_statement((value, index_node))
+            self.emit_expression(value)
+            self.emit_expression(index_node)
+            self._cse = None
+            self.vm.write_push(base.segment, base.index)
+            self.vm.write_arithmetic("add")
+            self.vm.write_pop("pointer", 1)
+            self.vm.write_pop("that", 0)
+            self.direct_array_stores += 1
+            return
+        self._begin_statement((value,) if index_node is None else (index_node, value))
+        if index_node is not None:
+            self.emit_expression(index_node)
+            self.vm.write_push(base.segment, base.index)
+            self.vm.write_arithmetic("add")
+        self.emit_expression(value)
+        self._cse = None
+        if index_node is not None:
             self.vm.write_pop("temp", 0)
             self.vm.write_pop("pointer", 1)
             self.vm.write_push("temp", 0)
             self.vm.write_pop("that", 0)
         else:
-            kind = self.st.kind_of(var_name)
-            index = self.st.index_of(var_name)
-            if kind is None or index is None:
-                self.er.add_error(self.file_name, var_name_token.index, f"Undefined variable '{var_name}' in let statement.")
-                seg = 'local'
-                index = 0
+            symbol = self.st.resolve(var_name)
+            if symbol is None:
+                self._error(var_name_token.index, f"Undefined variable '{var_name}' in let statement.", UNDEFINED_VARIABLE)
+                self.vm.write_pop('local', 0)
             else:
-                seg = self._kind_to_segment(kind)
-            self.vm.write_pop(seg, index)
+                self.vm.write_pop(symbol.segment, symbol.index)
+
+    def _stores_directly(self, index_node, value):
+        # The value can be pushed before the address is computed when that
+        # cannot change what is stored: constants (also negated, or true)
+        # never change, and a call in the index cannot change the caller's
+        # locals, arguments or `this`. It can change fields and statics, so
+        # those need an index without calls.
+        if self.array_stores != "direct":
+            return False
+        if type(value) is Unary:
+            value = value.operand
+        t = type(value)
+        if t is Const:
+            return True
+        if t is Var:
+            return value.segment in ("local", "argument", "pointer") or not has_call(index_node)
+        return False
 
     def compile_while(self):
         self._advance("keyword", "while")
         self._advance("symbol", "(")
+        if self.branch_layout:
+            self._compile_while_layout()
+            return
         start_label = self.label_gen.generate("WHILE_EXP")
         end_label = self.label_gen.generate("WHILE_END")
         self.vm.write_label(start_label)
@@ -259,6 +416,9 @@ class CompilationEngine:
     def compile_if(self):
         self._advance("keyword", "if")
         self._advance("symbol", "(")
+        if self.branch_layout:
+            self._compile_if_layout()
+            return
         self.compile_expression()
         self._advance("symbol", ")")
         false_label = self.label_gen.generate("IF_FALSE_")
@@ -277,6 +437,92 @@ class CompilationEngine:
             self._advance("symbol", "}")
         self.vm.write_label(end_label)
     
+    def _compile_block(self):
+        self._advance("symbol", "{")
+        self.compile_statements()
+        self._advance("symbol", "}")
+
+    def _compile_while_layout(self):
+        # Rotated loop with the test at the bottom, so an iteration costs the
+        # condition and one if-goto instead of not/if-goto/goto:
+        #     goto WHILE_EXP; label WHILE_BODY; body
+        #     label WHILE_EXP; cond; if-goto WHILE_BODY
+        # The plain if-goto is only equivalent when the condition is known to
+        # be 0 or -1; other conditions keep the usual shape.
+        condition = self._prepare(self.parse_expression())
+        self._advance("symbol", ")")
+        if not is_boolean(condition):
+            start_label = self.label_gen.generate("WHILE_EXP")
+            end_label = self.label_gen.generate("WHILE_END")
+            self.vm.write_label(start_label)
+            self._write_jump_if_false(condition, end_label)
+            self._compile_block()
+            self.vm.write_goto(start_label)
+            self.vm.write_label(end_label)
+            return
+        test_label = self.label_gen.generate("WHILE_EXP")
+        body_label = self.label_gen.generate("WHILE_BODY")
+        self.vm.write_goto(test_label)
+        self.vm.write_label(body_label)
+        self._compile_block()
+        self.vm.write_label(test_label)
+        self._emit_prepared(condition)
+        self.vm.write_if(body_label)
+
+    def _compile_if_layout(self):
+        # The then-branch is compiled first and pasted back once we know
+        # whether there is an else:
+        #   no else:          jump-if-false END; then; label END
+        #   boolean cond:     cond; if-goto TRUE; else; goto END;
+        #                     label TRUE; then; label END
+        #   other cond:       jump-if-false FALSE; then; goto END;
+        #                     label FALSE; else; label END
+        condition = self._prepare(self.parse_expression())
+        self._advance("symbol", ")")
+        start = len(self.vm)
+        self._compile_block()
+        then_code = self.vm.cut(start)
+        if not (self._peek() and self._peek().tag == "keyword" and self._peek().value == "else"):
+            end_label = self.label_gen.generate("IF_END_")
+            self._write_jump_if_false(condition, end_label)
+            self.vm.paste(then_code)
+            self.vm.write_label(end_label)
+            return
+        self._advance("keyword", "else")
+        if is_boolean(condition):
+            true_label = self.label_gen.generate("IF_TRUE_")
+            end_label = self.label_gen.generate("IF_END_")
+            self._emit_prepared(condition)
+            self.vm.write_if(true_label)
+            self._compile_block()
+            self.vm.write_goto(end_label)
+            self.vm.write_label(true_label)
+            self.vm.paste(then_code)
+        else:
+            false_label = self.label_gen.generate("IF_FALSE_")
+            end_label = self.label_gen.generate("IF_END_")
+            self._write_jump_if_false(condition, false_label)
+            self.vm.paste(then_code)
+            self.vm.write_goto(end_label)
+            self.vm.write_label(false_label)
+            self._compile_block()
+        self.vm.write_label(end_label)
+
+    def _write_jump_if_false(self, condition, label):
+        # Jumps when the condition is not -1, like `not; if-goto`, but
+        # without the `not` where the condition allows it: not(~x) is x, and
+        # a relation against a constant can be inverted at compile time.
+        if type(condition) is Unary and condition.op == "~":
+            self._emit_prepared(condition.operand)
+        else:
+            inverted = invert_relation(condition)
+            if inverted is not None:
+                self._emit_prepared(inverted)
+            else:
+                self._emit_prepared(condition)
+                self.vm.write_arithmetic("not")
+        self.vm.write_if(label)
+
     def compile_return(self):
         self._advance("keyword", "return")
         if self._peek() and self._peek().tag == "symbol" and self._peek().value == ";":
@@ -287,142 +533,327 @@ class CompilationEngine:
         self.vm.write_return()
 
     def compile_expression(self):
-        self.compile_term()
-        while self._peek() and self._peek().tag == "symbol" and self._peek().value in ("+", "-", "*", "/", "&", "|", "<", ">", "="):
-            op_token = self._advance("symbol")
-            self.compile_term()
-            self._write_arithmetic_op(op_token.value)
-    
+        self._emit_tree(self.parse_expression())
+
     def compile_term(self):
+        self._emit_tree(self.parse_term())
+
+    def _prepare(self, node):
+        return fold(node) if self.opt_level >= 1 else node
+
+    def _emit_tree(self, node):
+        self._emit_prepared(self._prepare(node))
+
+    def _emit_prepared(self, node):
+        self._begin_statement((node,))
+        self.emit_expression(node)
+        self._cse = None
+
+    def _begin_statement(self, trees):
+        # With cse enabled, picks the repeated subexpressions of trees (all
+        # the expressions of one statement, in emission order); the first
+        # emission of each is stored in a temp slot and later ones push it.
+        if self.cse:
+            self._cse, self._cse_loads = common_subexpressions(trees)
+            self._cse_slots = {}
+            self._cse_next = CSE_FIRST_TEMP
+
+    def compile_subroutine_call(self):
+        ident = self._advance('identifier')
+        if ident:
+            self.compile_subroutine_call_starting_with(ident.value)
+
+    def compile_subroutine_call_starting_with(self,first_ident):
+        self._emit_tree(self.parse_subroutine_call_starting_with(first_ident))
+
+    def parse_expression(self):
+        return self._parse([[_EXPR, None, None]])
+
+    def parse_term(self):
+        return self._parse([])
+
+    def parse_subroutine_call_starting_with(self,first_ident):
+        stack = []
+        node = self._start_call(first_ident, stack)
+        return node if node is not None else self._parse(stack)
+
+    def _parse(self, stack):
+        # Expressions are parsed with an explicit stack of pending frames
+        # instead of Python recursion, so nesting depth is not limited by
+        # the interpreter stack. The loop alternates between reading the
+        # start of a term and handing a finished value to the frame on top
+        # of the stack; it returns once the frames it was given are all
+        # complete. Tokens are consumed and errors reported in the same order
+        # as a recursive descent parser would.
+        value = None
+        while True:
+            if value is None:
+                value = self._parse_term_start(stack)
+                continue
+            if not stack:
+                return value
+            frame = stack[-1]
+            kind = frame[0]
+            if kind == _EXPR:
+                if frame[1] is not None:
+                    value = Binary(frame[1], frame[2], value)
+                token = self._peek()
+                if token and token.tag == "symbol" and token.value in _BINARY_OPS:
+                    frame[1] = self._advance("symbol").value
+                    frame[2] = value
+                    value = None
+                else:
+                    stack.pop()
+            elif kind == _UNARY:
+                stack.pop()
+                value = Unary(frame[1], value)
+            elif kind == _PAREN:
+                stack.pop()
+                self._advance("symbol", ")")
+            elif kind == _INDEX:
+                stack.pop()
+                self._advance("symbol", "]")
+                ident_token = frame[1]
+                name = ident_token.value
+                symbol = self.st.resolve(name)
+                if symbol is None:
+                    self._error(ident_token.index, f"Undefined variable '{name}' in array access.", UNDEFINED_VARIABLE)
+                    value = ArrayRead(Var('local', 0), value)
+                else:
+                    value = ArrayRead(Var(symbol.segment, symbol.index), value)
+            else:
+                frame[3].append(value)
+                token = self._peek()
+                if token and token.tag == 'symbol' and token.value == ',':
+                    self._advance('symbol', ',')
+                    stack.append([_EXPR, None, None])
+                    value = None
+                else:
+                    stack.pop()
+                    self._advance('symbol', ')')
+                    value = self._record_call(frame[4], Call(frame[1], frame[2], frame[3]))
+
+    def _parse_term_start(self, stack):
+        # Returns a complete term, or None after pushing the frames that
+        # will complete it.
         token = self._peek()
         if token is None:
-            self.er.add_error(self.file_name, self.tr.current_index, "Unexpected end of file in term.")
-            return
+            self._error(self.tr.current_index, "Unexpected end of file in term.", UNEXPECTED_EOF)
+            return EMPTY
         if token.tag == "integerConstant" or token.tag == "int":
             t = self._advance("integerConstant")
             try:
                 value = int(t.value)
             except ValueError:
-                self.er.add_error(self.file_name, t.index, f"Invalid integer constant: {t.value}")
+                self._error(t.index, f"Invalid integer constant: {t.value}", INVALID_CONSTANT)
                 value = 0
-            self.vm.write_push("constant", value)
+            return Const(value)
         elif token.tag == "stringConstant" or token.tag == "string":
             t = self._advance("stringConstant")
-            string_value = t.value
-            #print(f"String literal: '{string_value}', length={len(string_value)}")
-            self.vm.write_push("constant", len(string_value))
-            self.vm.write_call("String.new", 1)
-            for char in string_value:
-                self.vm.write_push("constant", ord(char))
-                self.vm.write_call("String.appendChar", 2)
+            return Str(t.value)
         elif token.tag == "keyword" and token.value in ("true", "false", "null", "this"):
             t = self._advance("keyword")
             if t.value == "true":
-                self.vm.write_push("constant", 1)
-                self.vm.write_arithmetic("not")
+                return Unary("~", Const(0))
             elif t.value in ("false", "null"):
-                self.vm.write_push("constant", 0)
+                return Const(0)
             elif t.value == "this":
-                self.vm.write_push("pointer", 0)
+                return Var("pointer", 0)
         elif token.tag == "symbol" and token.value == "(":
             self._advance("symbol", "(")
-            self.compile_expression()
-            self._advance("symbol", ")")
+            stack.append([_PAREN])
+            stack.append([_EXPR, None, None])
+            return None
         elif token.tag == "symbol" and token.value in ("-", "~"):
             unary_op = self._advance("symbol")
-            self.compile_term()
-            if unary_op.value == "-":
-                self.vm.write_arithmetic("neg")
-            elif unary_op.value == "~":
-                self.vm.write_arithmetic("not")
+            stack.append([_UNARY, unary_op.value])
+            return None
         elif token.tag == "identifier":
             ident_token = self._advance("identifier")
             name = ident_token.value
-            if self._peek() and self._peek().tag == "symbol" and self._peek().value == "[":
+            token = self._peek()
+            if token and token.tag == "symbol" and token.value == "[":
                 self._advance("symbol", "[")
-                self.compile_expression()
-                self._advance("symbol", "]")
-                kind = self.st.kind_of(name)
-                index = self.st.index_of(name)
-                if kind is None or index is None:
-                    self.er.add_error(self.file_name, ident_token.index, f"Undefined variable '{name}' in array access.")
-                    seg = 'local'
-                    index = 0
-                else:
-                    seg = self._kind_to_segment(kind)
-                self.vm.write_push(seg, index)
-                self.vm.write_arithmetic("add")
-                self.vm.write_pop("pointer", 1)
-                self.vm.write_push("that", 0)
-            elif self._peek() and self._peek().tag == "symbol" and self._peek().value in ("(", "."):
-                self.compile_subroutine_call_starting_with(name)
+                stack.append([_INDEX, ident_token])
+                stack.append([_EXPR, None, None])
+                return None
+            elif token and token.tag == "symbol" and token.value in ("(", "."):
+                return self._start_call(name, stack)
             else:
-                kind = self.st.kind_of(name)
-                index = self.st.index_of(name)
-                if kind is None or index is None:
-                    self.er.add_error(self.file_name, ident_token.index, f"Undefined variable '{name}' in term.")
-                    seg = 'constant'
-                    index = 0
-                else:
-                    seg = self._kind_to_segment(kind)
-                self.vm.write_push(seg, index)
+                symbol = self.st.resolve(name)
+                if symbol is None:
+                    self._error(ident_token.index, f"Undefined variable '{name}' in term.", UNDEFINED_VARIABLE)
+                    return Var('constant', 0)
+                return Var(symbol.segment, symbol.index)
         else:
-            self.er.add_error(self.file_name, token.index, f"Unexpected token in term: {token.value}")
-            self._advance()
-    
+            self._syntax_error(token.index, f"Unexpected token in term: {token.value}", UNEXPECTED_TOKEN)
+        return EMPTY
 
-    def compile_subroutine_call(self):
-        ident = self._advance('identifier')
-        if ident:
-            self.compile_subroutine_call_starting_with(ident.value)
-    
-    def compile_subroutine_call_starting_with(self,first_ident):
-        n_args = 0
-        if self._peek() and self._peek().tag == 'symbol' and self._peek().value == '.':
+    def _start_call(self, first_ident, stack):
+        # Parses up to the argument list. Returns the Call when there are no
+        # arguments (or EMPTY on error), otherwise None after pushing the
+        # frames for the arguments.
+        token_index = self.tr.current_index - 1
+        token = self._peek()
+        if token and token.tag == 'symbol' and token.value == '.':
             self._advance('symbol','.')
             second = self._advance('identifier')
             if second is None:
-                self.er.add_error(self.file_name, self.tr.current_index, "Expected subroutine name after '.'.")
-                return
+                self._error(self.tr.current_index, "Expected subroutine name after '.'.")
+                return EMPTY
             sub_name = second.value
-            kind = self.st.kind_of(first_ident)
-            if kind is not None:
-                index = self.st.index_of(first_ident)
-                seg = self._kind_to_segment(kind)
-                if index is None:
-                    self.er.add_error(self.file_name, self.tr.current_index, f"Undefined variable '{first_ident}' in subroutine call.")
-                    index = 0
-                self.vm.write_push(seg, index)
-                n_args += 1
-                class_name = self.st.type_of(first_ident)
-                full_name = f"{class_name}.{sub_name}"
+            symbol = self.st.resolve(first_ident)
+            if symbol is not None:
+                receiver = Var(symbol.segment, symbol.index)
+                full_name = f"{symbol.type}.{sub_name}"
             else:
+                receiver = None
                 full_name = f"{first_ident}.{sub_name}"
-                n_args=0
         else:
             full_name = f"{self.class_name}.{first_ident}"
-            self.vm.write_push("pointer", 0)
-            n_args = 1
+            receiver = Var("pointer", 0)
 
         self._advance('symbol', '(')
-        n_args += self.compile_expression_list()
-        self._advance('symbol', ')')
+        token = self._peek()
+        if token and token.tag == 'symbol' and token.value == ')':
+            self._advance('symbol', ')')
+            return self._record_call(token_index, Call(full_name, receiver, []))
+        stack.append([_ARGS, full_name, receiver, [], token_index])
+        stack.append([_EXPR, None, None])
+        return None
 
-        self.vm.write_call(full_name, n_args)
+    def _record_call(self, token_index, call):
+        self.calls.append((token_index, call.name, len(call.args), call.receiver is not None))
+        return call
 
-    def compile_expression_list(self):
-        if self._peek() and self._peek().tag =='symbol' and self._peek().value == ')':
-            return 0
-        count = 0
-        while True:
-            self.compile_expression()
-            count +=1
-            if self._peek() and self._peek().tag =='symbol' and self._peek().value == ',':
-                self._advance('symbol',',')
+    def emit_expression(self, node):
+        # Post-order walk with an explicit stack. Entries are tree nodes or,
+        # for work left after a node's operands, plain (function, *args)
+        # tuples; tree nodes are namedtuples, so `type(item) is tuple` tells
+        # them apart.
+        vm = self.vm
+        cse = self._cse
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            t = type(node)
+            if t is tuple:
+                node[0](*node[1:])
                 continue
-            break
-        return count
-    
+            if cse:
+                key = cse.get(id(node))
+                if key is not None:
+                    slot = self._cse_slots.get(key)
+                    if slot is not None:
+                        vm.write_push("temp", slot)
+                        self.cse_reused += 1
+                        self.cse_loads_eliminated += self._cse_loads[key]
+                        continue
+                    if self._cse_next <= CSE_LAST_TEMP:
+                        slot = self._cse_slots[key] = self._cse_next
+                        self._cse_next += 1
+                        stack.append((self._write_cse_store, slot))
+            if t is Const:
+                self._write_constant(node.value)
+            elif t is Var:
+                vm.write_push(node.segment, node.index)
+            elif t is Binary:
+                stack.append((self._write_arithmetic_op, node.op))
+                stack.append(node.right)
+                stack.append(node.left)
+            elif t is Unary:
+                stack.append((vm.write_arithmetic, "neg" if node.op == "-" else "not"))
+                stack.append(node.operand)
+            elif t is ArrayRead:
+                stack.append((self._write_array_read, node.base))
+                stack.append(node.index)
+            elif t is Call:
+                stack.append((vm.write_call, node.name, len(node.args) + (node.receiver is not None)))
+                stack.extend(reversed(node.args))
+                if node.receiver is not None:
+                    stack.append(node.receiver)
+            elif t is Str:
+                if self.strings == "intern":
+                    vm.write_call(self._string_helper(node.value), 0)
+                else:
+                    self._write_string(node.value)
+            elif t is Double:
+                # x * 2**k as k doublings. A variable is simply pushed twice
+                # for the first one.
+                times = node.times
+                operand = node.operand
+                if type(operand) is Var and times:
+                    vm.write_push(operand.segment, operand.index)
+                    vm.write_push(operand.segment, operand.index)
+                    vm.write_arithmetic("add")
+                    self._write_doublings(times - 1)
+                else:
+                    stack.append((self._write_doublings, times))
+                    stack.append(operand)
+
+    def _write_cse_store(self, slot):
+        self.vm.write_pop("temp", slot)
+        self.vm.write_push("temp", slot)
+
+    def _write_array_read(self, base):
+        self.vm.write_push(base.segment, base.index)
+        self.vm.write_arithmetic("add")
+        self.vm.write_pop("pointer", 1)
+        self.vm.write_push("that", 0)
+
+    def _write_string(self, value):
+        self.vm.write_push("constant", len(value))
+        self.vm.write_call("String.new", 1)
+        for char in value:
+            self.vm.write_push("constant", ord(char))
+            self.vm.write_call("String.appendChar", 2)
+
+    def _string_helper(self, value):
+        name = self.string_helpers.get(value)
+        if name is None:
+            name = self.string_helpers[value] = f"{self.class_name}.$str{len(self.string_helpers)}"
+        return name
+
+    def _write_string_helpers(self):
+        # One function per distinct literal, appended after the class's own
+        # subroutines. The first call builds the String and keeps it in a
+        # static slot after the class's statics; later calls return the same
+        # object, so a literal costs one call instead of 1 + len calls.
+        for value, name in self.string_helpers.items():
+            self.st.define(name, "String", "static")
+            slot = self.st.resolve(name).index
+            self.vm.write_function(name, 0)
+            self.vm.write_push("static", slot)
+            self.vm.write_if("STR_READY")
+            self._write_string(value)
+            self.vm.write_pop("static", slot)
+            self.vm.write_label("STR_READY")
+            self.vm.write_push("static", slot)
+            self.vm.write_return()
+
+    def _write_constant(self, value):
+        # Source literals are never negative; folded values can be.
+        if value >= 0:
+            self.vm.write_push("constant", value)
+        elif value == -1:
+            self.vm.write_push("constant", 0)
+            self.vm.write_arithmetic("not")
+        elif value == -32768:
+            self.vm.write_push("constant", 32767)
+            self.vm.write_arithmetic("not")
+        else:
+            self.vm.write_push("constant", -value)
+            self.vm.write_arithmetic("neg")
+
+    def _write_doublings(self, times):
+        # The value on the stack is parked in temp 1, which is free again as
+        # soon as the add has consumed both copies.
+        for _ in range(times):
+            self.vm.write_pop("temp", 1)
+            self.vm.write_push("temp", 1)
+            self.vm.write_push("temp", 1)
+            self.vm.write_arithmetic("add")
+
     def _write_arithmetic_op(self,op):
         if op == '+':
             self.vm.write_arithmetic('add')
@@ -443,11 +874,4 @@ class CompilationEngine:
         elif op == '=':
             self.vm.write_arithmetic('eq')
         else:
-            self.er.add_error(self.file_name,self.tr.current_index,f"Unknown operator '{op}'")
-    
-    def _kind_to_segment(self,kind):
-        if kind == 'static': return 'static'
-        if kind == 'field': return 'this'
-        if kind == 'arg': return 'argument'
-        if kind == 'var': return 'local'
-        return 'local'
\ No newline at end of file
+            self._error(self.tr.current_index, f"Unknown operator '{op}'", UNKNOWN_OPERATOR)
@@ -0,0 +1,48 @@
+from peephole import parse_rules
+
+class CompileOptions:
+    # Per-build settings threaded from the command line down to compile_file.
+    # Instances are pickled to worker processes, so keep them plain data.
+    def __init__(self, stream_tokens=False, lookahead=256, peephole_rules=None, opt_level=0, in_memory=False,
+                 profile=False, profile_trace=False, strings="inline", cse=False,
+                 branch_layout=False, array_stores="temp", labels="class", max_errors=0, target="vm", check_calls=False):
+        self.stream_tokens = stream_tokens
+        self.lookahead = lookahead
+        self.peephole_rules = peephole_rules
+        self.opt_level = opt_level
+        # String literal strategy, see CompilationEngine.strings.
+        self.strings = strings
+        self.cse = cse
+        self.branch_layout = branch_layout
+        self.array_stores = array_stores
+        self.labels = labels
+        # Stop compiling a file after this many errors; 0 means no limit.
+        self.max_errors = max_errors
+        # Return the VM code to the driver instead of writing .vm files: as
+        # text, or as the VMWriter instruction stream for the "asm" target.
+        self.in_memory = in_memory
+        self.target = target
+        # Return each class's subroutines and calls for the class index.
+        self.check_calls = check_calls
+        # Collect Profiler data per file; never changes the output.
+        self.profile = profile
+        self.profile_trace = profile_trace
+
+    @classmethod
+    def from_args(cls, args, in_memory=False):
+        peephole_rules = None
+        if args.peephole is not None:
+            peephole_rules = parse_rules(args.peephole)
+        return cls(stream_tokens=args.stream, lookahead=args.lookahead, peephole_rules=peephole_rules,
+                   opt_level=args.opt_level, in_memory=in_memory,
+                   profile=bool(args.profile or args.profile_json or args.profile_trace),
+                   profile_trace=bool(args.profile_trace), strings=args.strings, cse=args.cse,
+                   branch_layout=args.branch_layout, array_stores=args.array_stores, labels=args.labels,
+                   max_errors=args.max_errors, target=args.target,
+                   check_calls=bool(args.check_calls or args.class_index))
+
+    def fingerprint(self):
+        # Only settings that change the generated code or the diagnostics;
+        # cached output built with a different fingerprint is not reused.
+        return (f"O{self.opt_level};peephole={','.join(self.peephole_rules or ())};strings={self.strings};"
+                f"cse={int(self.cse)};branches={int(self.branch_layout)};array_stores={self.array_stores};labels={self.labels};max_errors={self.max_errors}")
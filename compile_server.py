@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import socket
+import socketserver
+import threading
+
+# Watch mode: one long-lived process that keeps the compiler imported and
+# warm, recompiles sources in a project directory as they change, and answers
+# compile requests over a Unix socket from `Jack_Compiler.py --client` or the
+# lighter `python compile_server.py PATH`.
+#
+# Protocol: the client sends one JSON object per line and reads JSON lines
+# back until the "done" event.
+#   {"command": "compile", "paths": [...]}   paths may be files or directories
+#   {"command": "shutdown"}
+# The server streams one "file" event per source as soon as it is compiled
+# (or found unchanged), then a "done" event with the totals.
+
+SOCKET_NAME = ".jack_compiler.sock"
+POLL_INTERVAL = 0.05
+
+def default_socket_path(input_path):
+    directory = input_path if os.path.isdir(input_path) else os.path.dirname(input_path)
+    return os.path.join(directory, SOCKET_NAME)
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+def file_event(result, status):
+    reporter = result.reporter
+    return {
+        "event": "file",
+        "path": result.path,
+        "out": result.out,
+        "status": status,
+        "errors": [[t, m, c] for _, t, m, c in reporter.errors],
+        "warnings": [[t, m, c] for _, t, m, c in reporter.warnings],
+        "notes": [m for _, m in reporter.notes],
+    }
+
+class CompileServer:
+    # compile_fn(path, options) -> CompileResult and sources_fn(path) -> list
+    # of sources are the driver's compile_file and collect_sources. A file is
+    # recompiled when its mtime or size differs from the last compile;
+    # otherwise the stored result is replayed.
+    def __init__(self, project_dir, options, compile_fn, sources_fn, poll_interval=POLL_INTERVAL):
+        self.project_dir = os.path.abspath(project_dir)
+        self.options = options
+        self.compile_fn = compile_fn
+        self.sources_fn = sources_fn
+        self.poll_interval = poll_interval
+        self.stamps = {}
+        self.results = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def sources(self, path=None):
+        try:
+            return [os.path.abspath(p) for p in self.sources_fn(path or self.project_dir)]
+        except ValueError:
+            return []
+
+    def refresh(self, paths=None):
+        # Yields (path, result, status) with status "compiled", "unchanged" or
+        # "missing". Without paths the whole project is checked and files that
+        # disappeared are forgotten.
+        with self.lock:
+            if paths is None:
+                paths = self.sources()
+                for gone in set(self.stamps) - set(paths):
+                    del self.stamps[gone]
+                    self.results.pop(gone, None)
+            for path in paths:
+                # Stamp before compiling, so an edit made during the compile
+                # is picked up by the next refresh.
+                stamp = _stamp(path)
+                if stamp is None:
+                    self.stamps.pop(path, None)
+                    self.results.pop(path, None)
+                    yield path, None, "missing"
+                    continue
+                result = self.results.get(path)
+                if result is not None and self.stamps.get(path) == stamp:
+                    yield path, result, "unchanged"
+                    continue
+                result = self.compile_fn(path, self.options)
+                self.stamps[path] = stamp
+                self.results[path] = result
+                self.show(result)
+                yield path, result, "compiled"
+
+    def show(self, result):
+        print(f"[INFO] Compiling: {result.path}")
+        result.reporter.show()
+        print(f"[✓] Generated: {result.out}", flush=True)
+
+    def watch(self):
+        while not self.stopped.wait(self.poll_interval):
+            for _ in self.refresh():
+                pass
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def send(self, message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        compiler = self.server.compiler
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            self.send({"event": "error", "message": "request is not valid JSON"})
+            return
+        command = request.get("command")
+        if command == "shutdown":
+            self.send({"event": "done"})
+            compiler.stopped.set()
+            self.server.shutdown()
+            return
+        if command != "compile":
+            self.send({"event": "error", "message": f"unknown command: {command}"})
+            return
+        start = time.perf_counter()
+        paths = []
+        for path in request.get("paths") or [compiler.project_dir]:
+            found = compiler.sources(os.path.abspath(path))
+            if not found:
+                self.send({"event": "error", "message": f"no Jack sources found at {path}"})
+            paths.extend(found)
+        files = compiled = errors = warnings = 0
+        for path, result, status in compiler.refresh(paths):
+            if result is None:
+                self.send({"event": "error", "message": f"source disappeared: {path}"})
+                continue
+            event = file_event(result, status)
+            files += 1
+            compiled += status == "compiled"
+            errors += len(event["errors"])
+            warnings += len(event["warnings"])
+            self.send(event)
+        self.send({
+            "event": "done",
+            "files": files,
+            "compiled": compiled,
+            "errors": errors,
+            "warnings": warnings,
+            "elapsed_ms": round(1000 * (time.perf_counter() - start), 2),
+        })
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def _claim_socket(socket_path):
+    # Removes a socket file left behind by a server that is no longer running.
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+            return
+    raise RuntimeError(f"A compile server is already listening on {socket_path}")
+
+def serve(compiler, socket_path):
+    _claim_socket(socket_path)
+    for _ in compiler.refresh():
+        pass
+    server = _UnixServer(socket_path, _RequestHandler)
+    server.compiler = compiler
+    watcher = threading.Thread(target=compiler.watch, daemon=True)
+    watcher.start()
+    print(f"[INFO] Watching {compiler.project_dir}, listening on {socket_path}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        compiler.stopped.set()
+        watcher.join()
+        server.server_close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+        print("[INFO] Compile server stopped.")
+
+def request(socket_path, message):
+    # Sends one request and yields the server's replies as they arrive.
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile('rb') as replies:
+            for line in replies:
+                reply = json.loads(line)
+                yield reply
+                if reply["event"] == "done":
+                    return
+
+def run_client(socket_path, paths):
+    # Prints the replies in the same format as a local build. Returns the
+    # number of errors, or None when the request failed.
+    failed = False
+    for reply in request(socket_path, {"command": "compile", "paths": [os.path.abspath(p) for p in paths]}):
+        event = reply["event"]
+        if event == "error":
+            print(f"Error: {reply['message']}")
+            failed = True
+        elif event == "file":
+            path = reply["path"]
+            for token_number, message, _ in reply["errors"]:
+                print(f"Error in {path} at token {token_number}: {message}")
+            for token_number, message, _ in reply["warnings"]:
+                print(f"Warning in {path} at token {token_number}: {message}")
+            for message in reply["notes"]:
+                print(message)
+            if reply["status"] == "compiled":
+                print(f"[✓] Generated: {reply['out']}")
+            else:
+                print(f"[=] Up to date: {reply['out']}")
+        elif event == "done":
+            print(f"[SUMMARY] {reply['files']} files ({reply['compiled']} recompiled), "
+                  f"{reply['errors']} errors, {reply['warnings']} warnings in {reply['elapsed_ms']} ms")
+            return None if failed else reply["errors"]
+    return None
+
+def main(argv=None):
+    # Light client entry point: only the standard library is imported, so a
+    # request costs interpreter startup plus the compile itself.
+    import sys
+    import argparse
+    parser = argparse.ArgumentParser(prog="compile_server.py", description="Send a compile request to a running `Jack_Compiler.py --watch` server.")
+    parser.add_argument("input_path", help="a .jack or *_myT.xml file, or a directory containing them")
+    parser.add_argument("--socket", metavar="PATH", help=f"compile server socket (default: <input dir>/{SOCKET_NAME})")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    socket_path = args.socket or default_socket_path(args.input_path)
+    try:
+        errors = run_client(socket_path, [args.input_path])
+    except OSError as e:
+        print(f"Error: cannot reach compile server at {socket_path}: {e}")
+        sys.exit(2)
+    sys.exit(2 if errors is None else 0)
+
+if __name__ == "__main__":
+    main()
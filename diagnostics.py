@@ -0,0 +1,88 @@
+import json
+from error_reporter import CODES
+
+# Machine-readable diagnostics. An ErrorReporter with a sink hands it each
+# error and warning as soon as it is reported, so a CI job can follow the
+# file while the build runs instead of parsing the console output at the end.
+# Files compiled in worker processes or replayed from the build cache are
+# forwarded when the driver reports them.
+#
+# Every entry has the file, the token index, the severity ("error" or
+# "warning"), the code (see error_reporter.CODES) and the message.
+
+FORMATS = ("jsonl", "sarif")
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+class DiagnosticSink:
+    # Counts errors and stops accepting them after max_errors (0 means no
+    # limit); the driver stops once full(), the compilation engine at the
+    # first error it drops. Without a stream nothing is written, so this
+    # also serves --stop-after alone.
+    def __init__(self, stream=None, max_errors=0):
+        self.stream = stream
+        self.max_errors = max_errors
+        self.errors = 0
+        self.warnings = 0
+
+    def full(self):
+        return bool(self.max_errors) and self.errors >= self.max_errors
+
+    def emit(self, severity, file_name, token_number, message, code):
+        if severity == "error":
+            if self.full():
+                return
+            self.errors += 1
+        else:
+            self.warnings += 1
+        if self.stream is not None:
+            self.write(severity, file_name, token_number, message, code)
+            self.stream.flush()
+
+    def write(self, severity, file_name, token_number, message, code):
+        pass
+
+    def close(self):
+        pass
+
+class JsonLinesSink(DiagnosticSink):
+    # One JSON object per line.
+    def write(self, severity, file_name, token_number, message, code):
+        self.stream.write(json.dumps({"file": file_name, "token": token_number, "severity": severity,
+                                      "code": code, "message": message}) + "\n")
+
+class SarifSink(DiagnosticSink):
+    # A SARIF 2.1.0 log with one run. The header is written up front and each
+    # result as it arrives; close() writes the closing brackets, so the file
+    # is only valid JSON once the build has finished. Token indexes have no
+    # SARIF location field of their own and go in the result's properties.
+    def __init__(self, stream=None, max_errors=0):
+        super().__init__(stream, max_errors)
+        self.results = 0
+        if stream is not None:
+            rules = [{"id": code, "shortDescription": {"text": text}} for code, text in sorted(CODES.items())]
+            header = json.dumps({"version": "2.1.0", "$schema": SARIF_SCHEMA,
+                                 "runs": [{"tool": {"driver": {"name": "Jack_Compiler", "rules": rules}},
+                                           "results": []}]})
+            # Everything up to the empty results array.
+            stream.write(header[:header.rindex("[]") + 1])
+            stream.flush()
+
+    def write(self, severity, file_name, token_number, message, code):
+        result = {
+            "level": severity,
+            "message": {"text": message},
+            "locations": [{"physicalLocation": {"artifactLocation": {"uri": file_name}}}],
+            "properties": {"token": token_number},
+        }
+        if code is not None:
+            result["ruleId"] = code
+        self.stream.write(("," if self.results else "") + "\n" + json.dumps(result))
+        self.results += 1
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.write("\n]}]}\n")
+            self.stream.flush()
+
+def open_sink(fmt, stream=None, max_errors=0):
+    return (SarifSink if fmt == "sarif" else JsonLinesSink)(stream, max_errors)
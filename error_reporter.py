@@ -1,21 +1,97 @@
+# Diagnostic codes, carried by every error and warning so tools do not have
+# to match on message text. 0xx: reading the input, 1xx: syntax,
+# 2xx: names and types, 3xx: code generation.
+INPUT_ERROR = "E001"
+LEXICAL_ERROR = "E002"
+SYNTAX_ERROR = "E100"
+UNEXPECTED_TOKEN = "E101"
+UNEXPECTED_EOF = "E102"
+UNDEFINED_VARIABLE = "E200"
+INVALID_TYPE = "E201"
+INVALID_CONSTANT = "E202"
+UNDEFINED_SUBROUTINE = "E203"
+CALL_MISMATCH = "E204"
+UNKNOWN_OPERATOR = "E300"
+
+CODES = {
+    INPUT_ERROR: "The token file could not be read.",
+    LEXICAL_ERROR: "The source contains text that is not a Jack token.",
+    SYNTAX_ERROR: "A required token or name is missing.",
+    UNEXPECTED_TOKEN: "A token appears where it is not allowed.",
+    UNEXPECTED_EOF: "The input ends in the middle of a construct.",
+    UNDEFINED_VARIABLE: "A variable is used without being declared.",
+    INVALID_TYPE: "A declaration names something that is not a type.",
+    INVALID_CONSTANT: "An integer constant cannot be represented.",
+    UNDEFINED_SUBROUTINE: "A call names a subroutine its class does not declare.",
+    CALL_MISMATCH: "A call does not match the subroutine's kind or parameter count.",
+    UNKNOWN_OPERATOR: "An operator has no VM translation.",
+}
+
 class ErrorReporter:
-    def __init__(self):
+    def __init__(self, max_errors=0, sink=None):
         self.errors = []
         self.warnings = []
+        self.notes = []
+        # Errors beyond max_errors are dropped (0 means no limit).
+        self.max_errors = max_errors
+        self._seen = set()
+        # Set when an error is dropped because of the limit; the compilation
+        # engine then stops. A file with exactly max_errors errors is still
+        # compiled to the end.
+        self.truncated = False
+        # Optional diagnostics sink (see diagnostics.py) that gets every
+        # error and warning as soon as it is reported.
+        self.sink = sink
+
+    def add_error(self,file_name, token_number, message, code=None):
+        # The same message at the same token is only reported once.
+        key = ("error", file_name, token_number, message)
+        if key in self._seen:
+            return
+        if self.full():
+            self.truncated = True
+            return
+        self._seen.add(key)
+        self.errors.append((file_name, token_number, message, code))
+        if self.sink is not None:
+            self.sink.emit("error", file_name, token_number, message, code)
 
-    def add_error(self,file_name, token_number, message):
-        self.errors.append((file_name, token_number, message))
+    def add_warning(self, file_name, token_number, message, code=None):
+        key = ("warning", file_name, token_number, message)
+        if key in self._seen:
+            return
+        self._seen.add(key)
+        self.warnings.append((file_name, token_number, message, code))
+        if self.sink is not None:
+            self.sink.emit("warning", file_name, token_number, message, code)
 
-    def add_warning(self, file_name, token_number, message):
-        self.warnings.append((file_name, token_number, message))
+    def add_note(self, file_name, message):
+        # Informational output such as optimization statistics; never counted
+        # as an issue.
+        self.notes.append((file_name, message))
+
+    def full(self):
+        if self.sink is not None and self.sink.full():
+            return True
+        return bool(self.max_errors) and len(self.errors) >= self.max_errors
+
+    def replay(self, sink):
+        # Sends the diagnostics of a finished file (compiled in a worker or
+        # restored from the build cache) to sink.
+        for file_name, token_number, message, code in self.errors:
+            sink.emit("error", file_name, token_number, message, code)
+        for file_name, token_number, message, code in self.warnings:
+            sink.emit("warning", file_name, token_number, message, code)
 
     def has_issues(self):
         return bool(self.errors or self.warnings)
-    
+
     def show(self):
-        for file_name, token_number, message in self.errors:
+        for file_name, token_number, message, _ in self.errors:
             print(f"Error in {file_name} at token {token_number}: {message}")
-        for file_name, token_number, message in self.warnings:
+        for file_name, token_number, message, _ in self.warnings:
             print(f"Warning in {file_name} at token {token_number}: {message}")
         if not self.errors and not self.warnings:
-            print("No errors or warnings found.")
\ No newline at end of file
+            print("No errors or warnings found.")
+        for file_name, message in self.notes:
+            print(message)
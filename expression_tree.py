@@ -0,0 +1,330 @@
+from collections import namedtuple
+
+# Expression trees built by CompilationEngine before any code is emitted.
+# Emitting a tree in post-order gives exactly the code the engine used to
+# write while parsing; the tree only exists so optimization passes can look
+# at a whole expression first.
+
+Const = namedtuple('Const', ['value'])
+Var = namedtuple('Var', ['segment', 'index'])
+Str = namedtuple('Str', ['value'])
+ArrayRead = namedtuple('ArrayRead', ['base', 'index'])
+Unary = namedtuple('Unary', ['op', 'operand'])
+Binary = namedtuple('Binary', ['op', 'left', 'right'])
+Call = namedtuple('Call', ['name', 'receiver', 'args'])
+# operand * 2**times, lowered to repeated doubling instead of Math.multiply.
+Double = namedtuple('Double', ['operand', 'times'])
+# Placeholder for a term that failed to parse; emits nothing.
+Empty = namedtuple('Empty', [])
+
+EMPTY = Empty()
+
+def to_int16(value):
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+def _power_of_two(value):
+    # k if value is 2**k as a 16-bit word (so -32768 is 2**15), else None.
+    value &= 0xFFFF
+    if value and not value & (value - 1):
+        return value.bit_length() - 1
+    return None
+
+def has_call(node):
+    # Iterative, like fold: trees from generated code can be very deep.
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        t = type(node)
+        if t is Call or t is Str:
+            return True
+        if t is ArrayRead:
+            stack.append(node.index)
+        elif t is Unary or t is Double:
+            stack.append(node.operand)
+        elif t is Binary:
+            stack.append(node.right)
+            stack.append(node.left)
+    return False
+
+def _divide(a, b):
+    # Jack division truncates toward zero.
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+def _evaluate(op, a, b):
+    if op == '+':
+        return to_int16(a + b)
+    if op == '-':
+        return to_int16(a - b)
+    if op == '*':
+        return to_int16(a * b)
+    if op == '/':
+        return to_int16(_divide(a, b))
+    if op == '&':
+        return to_int16(a & b)
+    if op == '|':
+        return to_int16(a | b)
+    if op == '<':
+        return -1 if a < b else 0
+    if op == '>':
+        return -1 if a > b else 0
+    if op == '=':
+        return -1 if a == b else 0
+    return None
+
+def fold(node):
+    # Constant folding and strength reduction with 16-bit two's complement
+    # semantics. Subexpressions are only ever dropped when they cannot have
+    # side effects.
+    #
+    # Children are folded before their parent without recursion: a node is
+    # pushed once to schedule its children and once more (with the flag set)
+    # to combine their results, which are collected on `done`.
+    done = []
+    stack = [(node, False)]
+    while stack:
+        node, ready = stack.pop()
+        t = type(node)
+        if not ready:
+            if t is Binary:
+                stack.append((node, True))
+                stack.append((node.right, False))
+                stack.append((node.left, False))
+            elif t is Unary:
+                stack.append((node, True))
+                stack.append((node.operand, False))
+            elif t is ArrayRead:
+                stack.append((node, True))
+                stack.append((node.index, False))
+            elif t is Call:
+                stack.append((node, True))
+                stack.extend((arg, False) for arg in reversed(node.args))
+                if node.receiver is not None:
+                    stack.append((node.receiver, False))
+            else:
+                done.append(node)
+        elif t is Binary:
+            right = done.pop()
+            done.append(_fold_binary(node.op, done.pop(), right))
+        elif t is Unary:
+            done.append(_fold_unary(node.op, done.pop()))
+        elif t is ArrayRead:
+            done.append(ArrayRead(node.base, done.pop()))
+        else:
+            start = len(done) - len(node.args)
+            args = done[start:]
+            del done[start:]
+            receiver = done.pop() if node.receiver is not None else None
+            done.append(Call(node.name, receiver, args))
+    return done[0]
+
+def _fold_unary(op, operand):
+    if type(operand) is Const:
+        value = to_int16(operand.value)
+        return Const(to_int16(-value) if op == '-' else to_int16(~value))
+    if type(operand) is Unary and operand.op == op:
+        return operand.operand
+    return Unary(op, operand)
+
+def _fold_binary(op, left, right):
+    lconst = type(left) is Const
+    rconst = type(right) is Const
+    if lconst and rconst:
+        a = to_int16(left.value)
+        b = to_int16(right.value)
+        if not (op == '/' and b == 0):
+            value = _evaluate(op, a, b)
+            if value is not None:
+                return Const(value)
+    if op in ('+', '*', '&', '|') and lconst and not rconst:
+        # Commutative, and pushing a constant has no side effects, so keep
+        # the constant on the right and let one set of rules cover both.
+        left, right = right, left
+        rconst = True
+    if not rconst:
+        return Binary(op, left, right)
+    c = to_int16(right.value)
+    if op in ('+', '-'):
+        # Reassociate (x + a) + b into x + (a + b).
+        if type(left) is Binary and left.op in ('+', '-') and type(left.right) is Const:
+            inner = to_int16(left.right.value)
+            total = (inner if left.op == '+' else -inner) + (c if op == '+' else -c)
+            return _fold_binary('+', left.left, Const(to_int16(total)))
+        if c == 0:
+            return left
+        if op == '+' and c < 0 and c != -32768:
+            return Binary('-', left, Const(-c))
+        if op == '-' and c < 0 and c != -32768:
+            return Binary('+', left, Const(-c))
+        return Binary(op, left, Const(c))
+    if op == '*':
+        if type(left) is Binary and left.op == '*' and type(left.right) is Const:
+            return _fold_binary('*', left.left, Const(to_int16(to_int16(left.right.value) * c)))
+        if c == 0 and not has_call(left):
+            return Const(0)
+        if c == 1:
+            return left
+        if c == -1:
+            return Unary('-', left)
+        k = _power_of_two(c)
+        if k is not None:
+            if type(left) is Double:
+                k += left.times
+                left = left.operand
+            if k >= 16 and not has_call(left):
+                return Const(0)
+            return Double(left, k)
+        k = _power_of_two(-c)
+        if k is not None:
+            return Unary('-', Double(left, k))
+        return Binary(op, left, Const(c))
+    if op == '/':
+        if c == 1:
+            return left
+        if c == -1:
+            return Unary('-', left)
+        return Binary(op, left, Const(c))
+    if op == '&':
+        if c == 0 and not has_call(left):
+            return Const(0)
+        if c == -1:
+            return left
+    if op == '|':
+        if c == 0:
+            return left
+        if c == -1 and not has_call(left):
+            return Const(-1)
+    return Binary(op, left, Const(c))
+
+def _children(node):
+    t = type(node)
+    if t is Binary:
+        return (node.left, node.right)
+    if t is Unary or t is Double:
+        return (node.operand,)
+    if t is ArrayRead:
+        return (node.index,)
+    if t is Call:
+        return ((node.receiver,) if node.receiver is not None else ()) + tuple(node.args)
+    return ()
+
+def _cost(node, child_costs):
+    # Rough instruction count of emitting node.
+    t = type(node)
+    if t is Const:
+        return 1 if node.value >= 0 else 2
+    if t is ArrayRead:
+        return child_costs + 4
+    if t is Double:
+        return child_costs + 4 * node.times
+    return child_costs + (0 if t is Empty else 1)
+
+def common_subexpressions(trees, min_cost=4):
+    # Finds subexpressions that repeat across `trees` (the expressions of one
+    # statement, in emission order) and are worth computing once and reusing
+    # from a temp slot. Only valid when nothing in the statement has side
+    # effects, so statements with any call or string literal get nothing.
+    #
+    # Returns ({id(node): key} for every node of a selected subexpression,
+    # {key: array reads in one copy}). Structurally equal subtrees share a
+    # key; keys are hash-consed bottom-up so deep trees never hash
+    # recursively.
+    if any(has_call(tree) for tree in trees):
+        return {}, {}
+    interned = {}
+    key_of = {}
+    cost = {}
+    loads = {}
+    counts = {}
+    nodes = []
+    stack = [(tree, False) for tree in reversed(trees)]
+    while stack:
+        node, ready = stack.pop()
+        children = _children(node)
+        if not ready and children:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        t = type(node)
+        child_keys = tuple(key_of[id(child)] for child in children)
+        if t is Const:
+            shape = (t, node.value)
+        elif t is Var:
+            shape = (t, node.segment, node.index)
+        elif t is ArrayRead:
+            shape = (t, node.base.segment, node.base.index) + child_keys
+        elif t is Double:
+            shape = (t, node.times) + child_keys
+        else:
+            shape = (t, getattr(node, 'op', None)) + child_keys
+        key = interned.get(shape)
+        if key is None:
+            key = interned[shape] = len(interned)
+            cost[key] = _cost(node, sum(cost[k] for k in child_keys))
+            loads[key] = (t is ArrayRead) + sum(loads[k] for k in child_keys)
+        key_of[id(node)] = key
+        counts[key] = counts.get(key, 0) + 1
+        nodes.append(node)
+    # Walk in emission order, not descending into copies that would be
+    # reused, so a repeat nested inside a reused subexpression is not
+    # counted twice.
+    uses = {}
+    stack = list(reversed(trees))
+    while stack:
+        node = stack.pop()
+        key = key_of[id(node)]
+        if counts[key] >= 2 and cost[key] >= min_cost:
+            if key in uses:
+                uses[key] += 1
+                continue
+            uses[key] = 1
+        stack.extend(reversed(_children(node)))
+    selected = {key for key, n in uses.items() if n >= 2}
+    return ({id(node): key_of[id(node)] for node in nodes if key_of[id(node)] in selected},
+            {key: loads[key] for key in selected})
+
+def is_boolean(node):
+    # True if node can only evaluate to 0 or -1 (Jack false/true).
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        t = type(node)
+        if t is Const:
+            if node.value not in (0, -1):
+                return False
+        elif t is Binary and node.op in ('<', '>', '='):
+            continue
+        elif t is Binary and node.op in ('&', '|'):
+            stack.append(node.left)
+            stack.append(node.right)
+        elif t is Unary and node.op == '~':
+            stack.append(node.operand)
+        else:
+            return False
+    return True
+
+def _constant_cost(value):
+    return 1 if value >= 0 else 2
+
+def invert_relation(node):
+    # A relation equal to ~node, for `x < k`, `x > k`, `k < x` and `k > x`
+    # with a constant k whose neighbour still fits in 16 bits and costs no
+    # more to push:
+    #   ~(x < k) = x > k-1    ~(x > k) = x < k+1
+    #   ~(k < x) = k+1 > x    ~(k > x) = k-1 < x
+    # Returns None for anything else.
+    if type(node) is not Binary or node.op not in ('<', '>'):
+        return None
+    flipped = '>' if node.op == '<' else '<'
+    if type(node.right) is Const:
+        k = node.right.value
+        adjusted = k - 1 if node.op == '<' else k + 1
+        if -32768 <= adjusted <= 32767 and _constant_cost(adjusted) <= _constant_cost(k):
+            return Binary(flipped, node.left, Const(adjusted))
+    if type(node.left) is Const:
+        k = node.left.value
+        adjusted = k + 1 if node.op == '<' else k - 1
+        if -32768 <= adjusted <= 32767 and _constant_cost(adjusted) <= _constant_cost(k):
+            return Binary(flipped, Const(adjusted), node.right)
+    return None
@@ -0,0 +1,252 @@
+from vm_writer import VMWriter, Op, Segment, ARITHMETIC_OPS, unpack
+
+# Hack assembly backend. Translates the compiler's VM instructions (the
+# packed words and name table of a VMWriter) straight to Hack assembly, so a
+# build needs neither the .vm text nor a separate VM translator. Prebuilt
+# .vm files, such as the OS, are read with read_vm and translated the same
+# way.
+#
+# The program is one .asm file: the bootstrap, the shared routines, then every
+# class. Calls, returns and comparisons jump to the shared routines instead of
+# repeating their code at every use:
+#   $$CALL     D = return address, R13 = callee, R14 = argument count
+#   $$RETURN
+#   $$EQ/$$GT/$$LT   D = return address; R15 holds it while comparing
+# Labels are scoped by function as `Function$label`, statics by class as
+# `Class.index`, and return addresses are `Function$ret.N`.
+
+BOOT_STACK = 256
+BOOT_ENTRY_POINTS = ("Sys.init", "Main.main")
+
+_OP_PUSH = int(Op.PUSH)
+_OP_POP = int(Op.POP)
+_OP_LABEL = int(Op.LABEL)
+_OP_GOTO = int(Op.GOTO)
+_OP_IF_GOTO = int(Op.IF_GOTO)
+_OP_FUNCTION = int(Op.FUNCTION)
+_OP_CALL = int(Op.CALL)
+_OP_RETURN = int(Op.RETURN)
+_OP_COMMENT = int(Op.COMMENT)
+
+_BASE_POINTERS = {int(Segment.LOCAL): "LCL", int(Segment.ARGUMENT): "ARG", int(Segment.THIS): "THIS", int(Segment.THAT): "THAT"}
+_CONSTANT = int(Segment.CONSTANT)
+_POINTER = int(Segment.POINTER)
+_TEMP = int(Segment.TEMP)
+_STATIC = int(Segment.STATIC)
+# Up to this index a local/argument/this/that pop steps A forward instead of
+# computing the address into R13.
+_POP_STEPS = 6
+
+_PUSH_D = ["@SP", "AM=M+1", "A=A-1", "M=D"]
+_POP_D = ["@SP", "AM=M-1", "D=M"]
+_BINARY = {int(Op.ADD): "M=D+M", int(Op.SUB): "M=M-D", int(Op.AND): "M=D&M", int(Op.OR): "M=D|M"}
+_UNARY = {int(Op.NEG): "M=-M", int(Op.NOT): "M=!M"}
+_COMPARE = {int(Op.EQ): "$$EQ", int(Op.GT): "$$GT", int(Op.LT): "$$LT"}
+
+def _comparison(name, x_negative_y_not, x_not_y_negative, jump):
+    # x and y of different signs decide the result without subtracting, which
+    # could overflow; otherwise the sign of x - y does.
+    return [
+        f"({name})", "@R15", "M=D",
+        *_POP_D, "@R13", "M=D",
+        "@SP", "A=M-1", "D=M",
+        f"@{name}.XNEG", "D;JLT",
+        "@R13", "D=M", f"@{x_not_y_negative}", "D;JLT",
+        f"@{name}.SUB", "0;JMP",
+        f"({name}.XNEG)", "@R13", "D=M", f"@{x_negative_y_not}", "D;JGE",
+        f"({name}.SUB)", "@R13", "D=M", "@SP", "A=M-1", "D=M-D", "@$$TRUE", f"D;{jump}",
+        "@$$FALSE", "0;JMP",
+    ]
+
+SHARED_ROUTINES = [
+    "($$CALL)",
+    *_PUSH_D,
+    "@LCL", "D=M", *_PUSH_D,
+    "@ARG", "D=M", *_PUSH_D,
+    "@THIS", "D=M", *_PUSH_D,
+    "@THAT", "D=M", *_PUSH_D,
+    "@R14", "D=M", "@5", "D=D+A", "@SP", "D=M-D", "@ARG", "M=D",
+    "@SP", "D=M", "@LCL", "M=D",
+    "@R13", "A=M", "0;JMP",
+    "($$RETURN)",
+    "@LCL", "D=M", "@R13", "M=D",
+    "@5", "A=D-A", "D=M", "@R14", "M=D",
+    *_POP_D, "@ARG", "A=M", "M=D",
+    "@ARG", "D=M+1", "@SP", "M=D",
+    "@R13", "AM=M-1", "D=M", "@THAT", "M=D",
+    "@R13", "AM=M-1", "D=M", "@THIS", "M=D",
+    "@R13", "AM=M-1", "D=M", "@ARG", "M=D",
+    "@R13", "AM=M-1", "D=M", "@LCL", "M=D",
+    "@R14", "A=M", "0;JMP",
+    "($$EQ)", "@R15", "M=D",
+    *_POP_D, "A=A-1", "D=M-D", "M=-1", "@$$EQ.END", "D;JEQ",
+    "@SP", "A=M-1", "M=0",
+    "($$EQ.END)", "@R15", "A=M", "0;JMP",
+    *_comparison("$$GT", "$$FALSE", "$$TRUE", "JGT"),
+    *_comparison("$$LT", "$$TRUE", "$$FALSE", "JLT"),
+    "($$TRUE)", "@SP", "A=M-1", "M=-1", "@R15", "A=M", "0;JMP",
+    "($$FALSE)", "@SP", "A=M-1", "M=0", "@R15", "A=M", "0;JMP",
+]
+
+def read_vm(text):
+    # VM text -> (code, names) as held by a VMWriter. Raises ValueError with
+    # the line number for anything that is not a VM command.
+    vm = VMWriter(None)
+    for number, line in enumerate(text.splitlines(), 1):
+        parts = line.split("//", 1)[0].split()
+        if not parts:
+            continue
+        command = parts[0]
+        try:
+            if command == "push":
+                vm.write_push(parts[1], int(parts[2]))
+            elif command == "pop":
+                vm.write_pop(parts[1], int(parts[2]))
+            elif command in ARITHMETIC_OPS and len(parts) == 1:
+                vm.write_arithmetic(command)
+            elif command == "label":
+                vm.write_label(parts[1])
+            elif command == "goto":
+                vm.write_goto(parts[1])
+            elif command == "if-goto":
+                vm.write_if(parts[1])
+            elif command == "function":
+                vm.write_function(parts[1], int(parts[2]))
+            elif command == "call":
+                vm.write_call(parts[1], int(parts[2]))
+            elif command == "return":
+                vm.write_return()
+            else:
+                raise ValueError(command)
+        except (IndexError, KeyError, ValueError):
+            raise ValueError(f"line {number}: not a VM command: {line.strip()}")
+    return vm.code, vm.names
+
+class AsmWriter:
+    # Translates one class at a time with add_class(); text() puts the
+    # bootstrap and the shared routines in front of them.
+    def __init__(self):
+        self.lines = []
+        self.defined = set()
+        self.called = set()
+        self.vm_instructions = 0
+        self._returns = 0
+
+    def _return_label(self, function):
+        self._returns += 1
+        return f"{function}$ret.{self._returns}"
+
+    def add_class(self, class_name, code, names):
+        out = self.lines
+        function = class_name
+        for word in code:
+            op, arg, num = unpack(word)
+            if op == _OP_COMMENT:
+                out.append(f"// {names[arg]}")
+                continue
+            self.vm_instructions += 1
+            if op == _OP_PUSH:
+                self._push(class_name, arg, num)
+            elif op == _OP_POP:
+                self._pop(class_name, arg, num)
+            elif op in _BINARY:
+                out += ["@SP", "AM=M-1", "D=M", "A=A-1", _BINARY[op]]
+            elif op in _UNARY:
+                out += ["@SP", "A=M-1", _UNARY[op]]
+            elif op in _COMPARE:
+                ret = self._return_label(function)
+                out += [f"@{ret}", "D=A", f"@{_COMPARE[op]}", "0;JMP", f"({ret})"]
+            elif op == _OP_LABEL:
+                out.append(f"({function}${names[arg]})")
+            elif op == _OP_GOTO:
+                out += [f"@{function}${names[arg]}", "0;JMP"]
+            elif op == _OP_IF_GOTO:
+                out += [*_POP_D, f"@{function}${names[arg]}", "D;JNE"]
+            elif op == _OP_FUNCTION:
+                function = names[arg]
+                self.defined.add(function)
+                out.append(f"({function})")
+                if num:
+                    out += ["@SP", "A=M"]
+                    out += ["M=0", "A=A+1"] * num
+                    out += ["D=A", "@SP", "M=D"]
+            elif op == _OP_CALL:
+                self._call(function, names[arg], num)
+            elif op == _OP_RETURN:
+                out += ["@$$RETURN", "0;JMP"]
+            else:
+                raise ValueError(f"{class_name}: unknown VM operation {op}")
+
+    def _push(self, class_name, segment, index):
+        out = self.lines
+        if segment == _CONSTANT:
+            if index <= 1:
+                out += ["@SP", "AM=M+1", "A=A-1", f"M={index}"]
+                return
+            out += [f"@{index}", "D=A"]
+        elif segment in _BASE_POINTERS:
+            base = _BASE_POINTERS[segment]
+            if index <= 1:
+                out += [f"@{base}", "A=M+1" if index else "A=M", "D=M"]
+            else:
+                out += [f"@{index}", "D=A", f"@{base}", "A=D+M", "D=M"]
+        else:
+            out += [self._address(class_name, segment, index), "D=M"]
+        out += _PUSH_D
+
+    def _pop(self, class_name, segment, index):
+        out = self.lines
+        if segment in _BASE_POINTERS:
+            base = _BASE_POINTERS[segment]
+            if index <= _POP_STEPS:
+                out += [*_POP_D, f"@{base}", "A=M"]
+                out += ["A=A+1"] * index
+                out.append("M=D")
+            else:
+                out += [f"@{index}", "D=A", f"@{base}", "D=D+M", "@R13", "M=D", *_POP_D, "@R13", "A=M", "M=D"]
+        else:
+            out += [*_POP_D, self._address(class_name, segment, index), "M=D"]
+
+    def _address(self, class_name, segment, index):
+        if segment == _POINTER:
+            return "@THAT" if index else "@THIS"
+        if segment == _TEMP:
+            return f"@{5 + index}"
+        if segment == _STATIC:
+            return f"@{class_name}.{index}"
+        raise ValueError(f"{class_name}: cannot address segment {segment} directly")
+
+    def _call(self, function, callee, n_args):
+        self.called.add(callee)
+        ret = self._return_label(function)
+        self.lines.extend([f"@{callee}", "D=A", "@R13", "M=D"])
+        if n_args <= 1:
+            self.lines.extend(["@R14", f"M={n_args}"])
+        else:
+            self.lines.extend([f"@{n_args}", "D=A", "@R14", "M=D"])
+        self.lines.extend([f"@{ret}", "D=A", "@$$CALL", "0;JMP", f"({ret})"])
+
+    def entry_point(self):
+        for name in BOOT_ENTRY_POINTS:
+            if name in self.defined:
+                return name
+        return None
+
+    def unresolved(self):
+        # Called functions no class defines; the Hack assembler would quietly
+        # turn each into a variable.
+        return sorted(self.called - self.defined)
+
+    def text(self):
+        entry = self.entry_point() or BOOT_ENTRY_POINTS[0]
+        boot = [
+            "// bootstrap",
+            f"@{BOOT_STACK}", "D=A", "@SP", "M=D",
+            f"@{entry}", "D=A", "@R13", "M=D", "@R14", "M=0",
+            "@$$HALT", "D=A", "@$$CALL", "0;JMP",
+            "($$HALT)", "@$$HALT", "0;JMP",
+        ]
+        return "\n".join(boot + SHARED_ROUTINES + self.lines) + "\n"
+
+def instruction_count(text):
+    return sum(1 for line in text.splitlines() if line and not line.startswith(("(", "//")))
@@ -0,0 +1,52 @@
+import re
+from error_reporter import LEXICAL_ERROR
+
+KEYWORDS = frozenset((
+    "class", "constructor", "function", "method", "field", "static", "var",
+    "int", "char", "boolean", "void", "true", "false", "null", "this",
+    "let", "do", "if", "else", "while", "return",
+))
+
+# One alternation per token class, tried in a single left-to-right pass.
+# Whitespace and comments are matched (and dropped) like any other token, so
+# the scanner never backtracks over the source.
+TOKEN_RE = re.compile(r'''
+    (?P<skip>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<integerConstant>\d+)
+  | "(?P<stringConstant>[^"\n]*)"
+  | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<comment>/\*)
+  | (?P<symbol>[{}()\[\].,;+\-*/&|<>=~])
+  | (?P<string>"[^"\n]*)
+  | (?P<bad>.)
+''', re.S | re.X)
+
+def iter_jack_tokens(file_path, reporter):
+    # Yields (tag, text) pairs exactly as iter_token_file does for the
+    # equivalent *_myT.xml file. Lexical errors are reported and scanning
+    # continues after the offending character.
+    with open(file_path) as f:
+        source = f.read()
+    idx = 0
+    for m in TOKEN_RE.finditer(source):
+        kind = m.lastgroup
+        if kind == "skip":
+            continue
+        if kind == "word":
+            text = m.group(kind)
+            yield ("keyword" if text in KEYWORDS else "identifier"), text
+        elif kind == "symbol" or kind == "integerConstant" or kind == "stringConstant":
+            yield kind, m.group(kind)
+        elif kind == "comment":
+            reporter.add_error(file_path, idx, f"Unterminated comment at line {_line_of(source, m.start())}.", LEXICAL_ERROR)
+            return
+        elif kind == "string":
+            reporter.add_error(file_path, idx, f"Unterminated string constant at line {_line_of(source, m.start())}.", LEXICAL_ERROR)
+            continue
+        else:
+            reporter.add_error(file_path, idx, f"Invalid character {m.group(kind)!r} at line {_line_of(source, m.start())}.", LEXICAL_ERROR)
+            continue
+        idx += 1
+
+def _line_of(source, offset):
+    return source.count("\n", 0, offset) + 1
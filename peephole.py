@@ -0,0 +1,164 @@
+from vm_writer import Op, Segment
+
+# Peephole optimization over the (op, arg, num) instructions held by
+# VMWriter.
+#
+# Window rules look at the tail of the output as each instruction is copied
+# over, so a rewrite that exposes another pattern (e.g. removing a
+# `push x / pop x` pair between two `not`s) is picked up immediately. The
+# flow rules need the whole function and run as separate passes. Everything
+# repeats until nothing changes.
+
+PUSH = Op.PUSH
+POP = Op.POP
+NOT = Op.NOT
+NEG = Op.NEG
+LABEL = Op.LABEL
+GOTO = Op.GOTO
+IF_GOTO = Op.IF_GOTO
+FUNCTION = Op.FUNCTION
+RETURN = Op.RETURN
+CONSTANT = Segment.CONSTANT
+
+PUSH_ZERO = (PUSH, CONSTANT, 0)
+
+def _double_not(out):
+    # not; not  ->  (nothing)
+    if len(out) >= 2 and out[-1][0] == NOT and out[-2][0] == NOT:
+        del out[-2:]
+        return True
+    return False
+
+def _double_neg(out):
+    # neg; neg  ->  (nothing)
+    if len(out) >= 2 and out[-1][0] == NEG and out[-2][0] == NEG:
+        del out[-2:]
+        return True
+    return False
+
+def _push_pop(out):
+    # push S i; pop S i  ->  (nothing)
+    if len(out) >= 2 and out[-1][0] == POP and out[-2][0] == PUSH and out[-1][1:] == out[-2][1:]:
+        del out[-2:]
+        return True
+    return False
+
+def _identity_op(out):
+    # push constant 0; add|sub|or  ->  (nothing)
+    # push constant 0; not; and  ->  (nothing)
+    if len(out) >= 2 and out[-2] == PUSH_ZERO and out[-1][0] in (Op.ADD, Op.SUB, Op.OR):
+        del out[-2:]
+        return True
+    if len(out) >= 3 and out[-1][0] == Op.AND and out[-2][0] == NOT and out[-3] == PUSH_ZERO:
+        del out[-3:]
+        return True
+    return False
+
+def _constant_branch(out):
+    # push constant 0; if-goto L  ->  (nothing)
+    # push constant k; if-goto L  ->  goto L        (k != 0)
+    # push constant 0; not; if-goto L  ->  goto L
+    if len(out) >= 2 and out[-1][0] == IF_GOTO:
+        label = out[-1][1]
+        if out[-2][0] == PUSH and out[-2][1] == CONSTANT:
+            taken = out[-2][2] != 0
+            del out[-2:]
+            if taken:
+                out.append((GOTO, label, 0))
+            return True
+        if len(out) >= 3 and out[-2][0] == NOT and out[-3] == PUSH_ZERO:
+            del out[-3:]
+            out.append((GOTO, label, 0))
+            return True
+    return False
+
+def _goto_next(out):
+    # goto L; label L  ->  label L
+    if len(out) >= 2 and out[-1][0] == LABEL and out[-2][0] == GOTO and out[-1][1] == out[-2][1]:
+        del out[-2]
+        return True
+    return False
+
+WINDOW_RULES = {
+    "double-not": _double_not,
+    "double-neg": _double_neg,
+    "push-pop": _push_pop,
+    "identity-op": _identity_op,
+    "constant-branch": _constant_branch,
+    "goto-next": _goto_next,
+}
+
+def _unreachable(code):
+    # Drops instructions after goto/return up to the next label or function.
+    out = []
+    dead = False
+    for ins in code:
+        op = ins[0]
+        if op == LABEL or op == FUNCTION:
+            dead = False
+        if not dead:
+            out.append(ins)
+        if op == GOTO or op == RETURN:
+            dead = True
+    return out
+
+def _unused_labels(code):
+    # Drops labels that nothing in the same function jumps to.
+    targets = set()
+    function = None
+    for op, arg, _ in code:
+        if op == FUNCTION:
+            function = arg
+        elif op == GOTO or op == IF_GOTO:
+            targets.add((function, arg))
+    out = []
+    function = None
+    for ins in code:
+        if ins[0] == FUNCTION:
+            function = ins[1]
+        elif ins[0] == LABEL and (function, ins[1]) not in targets:
+            continue
+        out.append(ins)
+    return out
+
+FLOW_RULES = {
+    "unreachable": _unreachable,
+    "unused-labels": _unused_labels,
+}
+
+RULES = tuple(WINDOW_RULES) + tuple(FLOW_RULES)
+
+def parse_rules(spec):
+    # "all" or a comma separated subset of RULES.
+    if spec is None or spec == "all":
+        return RULES
+    names = tuple(name.strip() for name in spec.split(",") if name.strip())
+    unknown = [name for name in names if name not in RULES]
+    if unknown:
+        raise ValueError(f"Unknown peephole rule(s): {', '.join(unknown)}. Available: {', '.join(RULES)}")
+    return names
+
+def _window_pass(code, rules):
+    out = []
+    for ins in code:
+        out.append(ins)
+        while any(rule(out) for rule in rules):
+            pass
+    return out
+
+def optimize(code, rules=RULES):
+    # Returns the rewritten instruction list. Comments are kept in place but
+    # block any pattern that spans them.
+    window = [WINDOW_RULES[name] for name in rules if name in WINDOW_RULES]
+    flow = [FLOW_RULES[name] for name in rules if name in FLOW_RULES]
+    while True:
+        size = len(code)
+        code = _window_pass(code, window)
+        for rule in flow:
+            code = rule(code)
+        if len(code) == size:
+            break
+    return code
+
+def instruction_count(code):
+    return sum(1 for ins in code if ins[0] != Op.COMMENT)
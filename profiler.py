@@ -0,0 +1,118 @@
+import os
+import json
+import time
+
+# Opt-in instrumentation for compile_file. Nothing here is touched unless
+# profiling is enabled: methods are wrapped on individual objects (the engine,
+# reader, symbol table and writer of one compile), never on their classes, so
+# a normal build runs the original code.
+#
+# For each label the profiler keeps the call count, the total time of the
+# outermost calls (recursion is not counted twice) and the self time, which
+# excludes time spent in nested instrumented calls.
+
+ENGINE_PREFIXES = ("compile_", "parse_", "emit_")
+READER_METHODS = ("advance", "peek")
+SYMBOL_METHODS = ("start_subroutine", "define", "resolve", "var_count", "kind_of", "type_of", "index_of")
+WRITER_PREFIXES = ("write_",)
+
+class Profiler:
+    def __init__(self, trace=False):
+        # label -> [calls, total_ns, self_ns, active]
+        self.stats = {}
+        # path -> wall time in seconds
+        self.files = {}
+        # Chrome trace-event "complete" events, only kept when tracing.
+        self.events = [] if trace else None
+        self._stack = []
+
+    def timed(self, label, fn):
+        stats = self.stats.setdefault(label, [0, 0, 0, 0])
+        stack = self._stack
+        events = self.events
+        clock = time.perf_counter_ns
+        pid = os.getpid()
+
+        def wrapper(*args, **kwargs):
+            stats[3] += 1
+            stack.append(0)
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                stats[3] -= 1
+                stats[0] += 1
+                stats[2] += elapsed - nested
+                if not stats[3]:
+                    stats[1] += elapsed
+                if events is not None:
+                    events.append({"name": label, "ph": "X", "ts": start / 1000, "dur": elapsed / 1000, "pid": pid, "tid": 0})
+        return wrapper
+
+    def call(self, label, fn, *args):
+        return self.timed(label, fn)(*args)
+
+    def instrument(self, obj, prefix, names=(), prefixes=()):
+        # Replaces the named methods, and those starting with any of prefixes,
+        # with timed wrappers on obj only. Labels are "<prefix>.<method>".
+        for name in dir(type(obj)):
+            if name in names or name.startswith(prefixes):
+                method = getattr(obj, name)
+                if callable(method):
+                    setattr(obj, name, self.timed(f"{prefix}.{name}", method))
+
+    def record_file(self, path, fn, *args):
+        start = time.perf_counter()
+        try:
+            return self.call("file", fn, *args)
+        finally:
+            self.files[path] = self.files.get(path, 0.0) + time.perf_counter() - start
+
+    def data(self):
+        # Plain data, so it can be returned from a worker process and merged.
+        return {
+            "phases": {label: {"calls": s[0], "total_s": s[1] / 1e9, "self_s": s[2] / 1e9}
+                       for label, s in self.stats.items() if s[0]},
+            "files": dict(self.files),
+            "events": self.events,
+        }
+
+class ProfileReport:
+    # Merges the data() of every compiled file for the whole build.
+    def __init__(self):
+        self.phases = {}
+        self.files = {}
+        self.events = []
+
+    def merge(self, data):
+        for label, s in data["phases"].items():
+            merged = self.phases.setdefault(label, {"calls": 0, "total_s": 0.0, "self_s": 0.0})
+            for key in merged:
+                merged[key] += s[key]
+        self.files.update(data["files"])
+        if data["events"]:
+            self.events.extend(data["events"])
+
+    def show(self, limit=25):
+        print("[PROFILE]")
+        print(f" {'phase':<48}{'calls':>10}{'total s':>10}{'self s':>10}")
+        ranked = sorted(self.phases.items(), key=lambda item: item[1]["self_s"], reverse=True)
+        for label, s in ranked[:limit]:
+            print(f" {label:<48}{s['calls']:>10}{s['total_s']:>10.4f}{s['self_s']:>10.4f}")
+        if self.files:
+            print(f" {'file':<68}{'seconds':>10}")
+            for path, seconds in sorted(self.files.items(), key=lambda item: item[1], reverse=True)[:limit]:
+                print(f" {path:<68}{seconds:>10.4f}")
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({"phases": self.phases, "files": self.files}, f, indent=2)
+
+    def write_trace(self, path):
+        # Loadable in chrome://tracing or Perfetto; each worker is its own pid.
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
@@ -1,51 +1,77 @@
 from collections import namedtuple
 
-Symbol = namedtuple('Symbol',['type','kind','index'])
+# segment is the VM segment for the kind, resolved once when the symbol is
+# defined.
+Symbol = namedtuple('Symbol',['type','kind','index','segment'])
+
+KIND_SEGMENTS = {'static':'static','field':'this','arg':'argument','var':'local'}
+CLASS_KINDS = ('static','field')
 
 class SymbolTable:
+    # Scopes form a chain: the class scope at the bottom, the subroutine
+    # scope above it, then any scopes added with push_scope. Class-level kinds
+    # always go to the class scope, the others to the innermost scope.
+    # Lookups go through self.visible, which maps every name to the symbol
+    # that is currently in scope, so resolve() is a single dict lookup.
     def __init__(self):
         self.class_scope = {}
         self.subr_scope = {}
+        self.scopes = [self.class_scope, self.subr_scope]
+        self.visible = {}
         self.counts = {'static':0,'field':0,'var':0,'arg':0}
 
     def start_subroutine(self):
+        while len(self.scopes) > 1:
+            self.pop_scope()
         self.subr_scope = {}
+        self.push_scope(self.subr_scope)
         self.counts['var'] = 0
         self.counts['arg'] = 0
-    
+
+    def push_scope(self, scope=None):
+        self.scopes.append({} if scope is None else scope)
+
+    def pop_scope(self):
+        if len(self.scopes) == 1:
+            raise ValueError("Cannot pop the class scope")
+        scope = self.scopes.pop()
+        for name in scope:
+            for outer in reversed(self.scopes):
+                if name in outer:
+                    self.visible[name] = outer[name]
+                    break
+            else:
+                del self.visible[name]
+        return scope
+
     def define(self,name,type,kind):
         if kind not in self.counts:
             raise ValueError(f"Invalid kind: {kind}")
         index = self.counts[kind]
         self.counts[kind] += 1
-        symbol = Symbol(type,kind,index)
-        if kind in ('static','field'):
-            self.class_scope[name] = symbol
-        else:
-            self.subr_scope[name] = symbol
-    
+        symbol = Symbol(type,kind,index,KIND_SEGMENTS[kind])
+        level = 0 if kind in CLASS_KINDS else len(self.scopes) - 1
+        self.scopes[level][name] = symbol
+        if not any(name in scope for scope in self.scopes[level + 1:]):
+            self.visible[name] = symbol
+
+    def resolve(self,name):
+        # The Symbol the name refers to in the current scope, or None.
+        return self.visible.get(name)
+
     def var_count(self,kind):
         if kind not in self.counts:
             raise ValueError(f"Invalid kind: {kind}")
         return self.counts.get(kind,0)
-    
+
     def kind_of(self,name):
-        if name in self.subr_scope:
-            return self.subr_scope[name].kind
-        if name in self.class_scope:
-            return self.class_scope[name].kind
-        return None
-    
+        symbol = self.visible.get(name)
+        return symbol.kind if symbol is not None else None
+
     def type_of(self,name):
-        if name in self.subr_scope:
-            return self.subr_scope[name].type
-        if name in self.class_scope:
-            return self.class_scope[name].type
-        return None
+        symbol = self.visible.get(name)
+        return symbol.type if symbol is not None else None
 
     def index_of(self,name):
-        if name in self.subr_scope:
-            return self.subr_scope[name].index
-        if name in self.class_scope:
-            return self.class_scope[name].index
-        return None
\ No newline at end of file
+        symbol = self.visible.get(name)
+        return symbol.index if symbol is not None else None
@@ -1,4 +1,9 @@
 import xml.etree.ElementTree as ET
+from array import array
+from collections import deque
+from xml.sax.saxutils import escape
+from jack_tokenizer import iter_jack_tokens
+from error_reporter import INPUT_ERROR
 
 token_tags = {
     "keyword" : "keyword",
@@ -8,7 +13,12 @@ token_tags = {
     "stringConstant" : "string"
 }
 
+TAG_NAMES = tuple(token_tags)
+TAG_CODES = {tag: code for code, tag in enumerate(TAG_NAMES)}
+
 class Token:
+    __slots__ = ('tag', 'value', 'index')
+
     def __init__(self, tag, value, index):
         self.tag = tag
         self.value = value
@@ -17,62 +27,193 @@ class Token:
     def __repr__(self):
         return f"Token(tag={self.tag}, value={self.value}, index={self.index})"
 
+class TokenStore:
+    # Column storage for a token file: a one-byte tag code and an offset into
+    # a pool of unique value strings per token. Tokens are materialized on
+    # access, so only the ones the parser is looking at exist as objects.
+    def __init__(self):
+        self.tags = array('B')
+        self.values = array('I')
+        self.pool = []
+        self._pool_index = {}
+
+    def append(self, tag, value):
+        offset = self._pool_index.get(value)
+        if offset is None:
+            offset = len(self.pool)
+            self.pool.append(value)
+            self._pool_index[value] = offset
+        self.tags.append(TAG_CODES[tag])
+        self.values.append(offset)
+
+    def clear(self):
+        self.__init__()
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.tags)
+        return Token(TAG_NAMES[self.tags[index]], self.pool[self.values[index]], index)
+
+    def __iter__(self):
+        for index in range(len(self.tags)):
+            yield self[index]
+
+def iter_token_file(file_path, reporter):
+    # Yields (tag, text) for every known token element, reporting structural
+    # problems as it goes. Elements are cleared once read, so the XML tree
+    # never holds more than one token. XML syntax errors are raised.
+    root = None
+    depth = 0
+    idx = 0
+    seen_child = False
+    for event, elem in ET.iterparse(file_path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if elem is root:
+            if not seen_child:
+                reporter.add_error(file_path, 0, "Empty token file — no tokens found.", INPUT_ERROR)
+            return
+        if depth != 1:
+            continue
+        if not seen_child:
+            seen_child = True
+            if root.tag != "tokens":
+                reporter.add_error(file_path, 0, "Root tag is not 'tokens'", INPUT_ERROR)
+                return
+        tag = elem.tag
+        text = elem.text or ""
+        text = text[1:-1]
+        root.clear()
+        if tag not in token_tags:
+            reporter.add_error(file_path, idx, f"Unknown token tag: {tag}", INPUT_ERROR)
+            continue
+        yield tag, text
+        idx += 1
+
+def iter_tokens(file_path, reporter):
+    # Token files and Jack sources produce the same (tag, text) stream.
+    if file_path.endswith(".jack"):
+        return iter_jack_tokens(file_path, reporter)
+    return iter_token_file(file_path, reporter)
+
+def write_token_file(path, tokens):
+    # Writes (tag, text) pairs in the *_myT.xml format read above.
+    count = 0
+    with open(path, 'w') as f:
+        f.write("<tokens>\n")
+        for tag, value in tokens:
+            f.write(f"<{tag}> {escape(value)} </{tag}>\n")
+            count += 1
+        f.write("</tokens>\n")
+    return count
+
+def _report_load_error(reporter, file_path, e):
+    if isinstance(e, ET.ParseError):
+        reporter.add_error(file_path, 0, f"XML parsing error: {str(e)}", INPUT_ERROR)
+    else:
+        reporter.add_error(file_path, 0, f"Failed to load tokens: {str(e)}", INPUT_ERROR)
+
 class TokenReader:
     def __init__(self,file_path,reporter):
         self.file_path = file_path
         self.reporter = reporter
-        self.tokens = []
+        self.tokens = TokenStore()
         self.current_index = 0
+        self._peeked = None
         self._load_tokens()
 
     def _load_tokens(self):
         try:
-            tree = ET.parse(self.file_path)
-            root = tree.getroot()
-            if not list(root):
-                self.reporter.add_error(self.file_path, 0, "Empty token file — no tokens found.")
-                return
-            if root.tag != "tokens":
-                self.reporter.add_error(self.file_path, 0, "Root tag is not 'tokens'")
-                return
+            append = self.tokens.append
+            for tag, text in iter_tokens(self.file_path, self.reporter):
+                append(tag, text)
+        except Exception as e:
+            # A file that fails to parse yields no tokens at all.
+            self.tokens.clear()
+            _report_load_error(self.reporter, self.file_path, e)
+
+    def has_more_tokens(self):
+        return self.current_index < len(self.tokens)
+
+    def advance(self):
+        token = self.peek()
+        if token is not None:
+            self.current_index += 1
+            self._peeked = None
+        return token
+
+    def peek(self):
+        token = self._peeked
+        if token is None and self.has_more_tokens():
+            token = self._peeked = self.tokens[self.current_index]
+        return token
+
+    def rewind(self):
+        if self.current_index > 0:
+            self.current_index -= 1
+            self._peeked = None
+
+    def current_token(self):
+        return self.current_index
+
+    def reset(self):
+        self.current_index = 0
+        self._peeked = None
+
+class StreamingTokenReader:
+    # Reads tokens incrementally with iterparse into a bounded lookahead
+    # buffer, so memory tracks the window rather than the file size. Only
+    # peek/advance/current_index are supported; there is no rewind.
+    def __init__(self, file_path, reporter, lookahead=256):
+        self.file_path = file_path
+        self.reporter = reporter
+        self.lookahead = max(1, lookahead)
+        self.buffer = deque()
+        self.current_index = 0
+        self._source = self._iter_tokens()
+
+    def _iter_tokens(self):
+        try:
             idx = 0
-            for elem in root:
-                tag = elem.tag
-                text = elem.text or ""
-                text = text[1:-1]
-                if tag not in token_tags:
-                    self.reporter.add_error(self.file_path, idx, f"Unknown token tag: {tag}")
-                    continue
-                self.tokens.append(Token(tag, text, idx))
+            for tag, text in iter_tokens(self.file_path, self.reporter):
+                yield Token(tag, text, idx)
                 idx += 1
-        except ET.ParseError as e:
-            self.reporter.add_error(self.file_path, 0, f"XML parsing error: {str(e)}")
         except Exception as e:
-            self.reporter.add_error(self.file_path, 0, f"Failed to load tokens: {str(e)}")
-    
+            _report_load_error(self.reporter, self.file_path, e)
+
+    def _fill(self):
+        if self._source is None:
+            return
+        for token in self._source:
+            self.buffer.append(token)
+            if len(self.buffer) >= self.lookahead:
+                return
+        self._source = None
+
     def has_more_tokens(self):
-        return self.current_index < len(self.tokens)
-    
+        if not self.buffer:
+            self._fill()
+        return bool(self.buffer)
+
     def advance(self):
         if self.has_more_tokens():
-            token = self.tokens[self.current_index]
             self.current_index += 1
-            return token
+            return self.buffer.popleft()
         else:
             return None
-        
+
     def peek(self):
         if self.has_more_tokens():
-            return self.tokens[self.current_index]
+            return self.buffer[0]
         else:
             return None
-    
-    def rewind(self):
-        if self.current_index > 0:
-            self.current_index -= 1
 
     def current_token(self):
         return self.current_index
-    
-    def reset(self):
-        self.current_index = 0
\ No newline at end of file
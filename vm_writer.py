@@ -1,40 +1,177 @@
+from enum import IntEnum
+
+class Op(IntEnum):
+    PUSH = 0
+    POP = 1
+    ADD = 2
+    SUB = 3
+    NEG = 4
+    EQ = 5
+    GT = 6
+    LT = 7
+    AND = 8
+    OR = 9
+    NOT = 10
+    LABEL = 11
+    GOTO = 12
+    IF_GOTO = 13
+    FUNCTION = 14
+    CALL = 15
+    RETURN = 16
+    COMMENT = 17
+
+class Segment(IntEnum):
+    CONSTANT = 0
+    ARGUMENT = 1
+    LOCAL = 2
+    STATIC = 3
+    THIS = 4
+    THAT = 5
+    POINTER = 6
+    TEMP = 7
+
+SEGMENT_NAMES = tuple(s.name.lower() for s in Segment)
+SEGMENT_CODES = {name: code for code, name in enumerate(SEGMENT_NAMES)}
+ARITHMETIC_OPS = {op.name.lower(): int(op) for op in (Op.ADD, Op.SUB, Op.NEG, Op.EQ, Op.GT, Op.LT, Op.AND, Op.OR, Op.NOT)}
+
+# Each instruction is one 64-bit word: op in bits 0-7, segment code or name
+# id in bits 8-31, integer operand in bits 32-63.
+ARG_SHIFT = 8
+NUM_SHIFT = 32
+_ARG_MASK = (1 << (NUM_SHIFT - ARG_SHIFT)) - 1
+
+def pack(op, arg, num):
+    return op | arg << ARG_SHIFT | num << NUM_SHIFT
+
+def unpack(word):
+    return word & 0xFF, (word >> ARG_SHIFT) & _ARG_MASK, word >> NUM_SHIFT
+
+_PUSH_WORDS = {name: pack(Op.PUSH, code, 0) for name, code in SEGMENT_CODES.items()}
+_POP_WORDS = {name: pack(Op.POP, code, 0) for name, code in SEGMENT_CODES.items()}
+_ARITHMETIC_WORDS = dict(ARITHMETIC_OPS)
+_PUSH = int(Op.PUSH)
+_POP = int(Op.POP)
+_LABEL = int(Op.LABEL)
+_GOTO = int(Op.GOTO)
+_IF_GOTO = int(Op.IF_GOTO)
+_CALL = int(Op.CALL)
+_FUNCTION = int(Op.FUNCTION)
+_RETURN = int(Op.RETURN)
+_COMMENT = int(Op.COMMENT)
+_FIXED_TEXT = {op: name for name, op in ARITHMETIC_OPS.items()}
+_FIXED_TEXT[_RETURN] = "return"
+_NAMED_PREFIX = {_LABEL: "label ", _GOTO: "goto ", _IF_GOTO: "if-goto ", _COMMENT: "// "}
+_COUNTED_PREFIX = {_CALL: "call ", _FUNCTION: "function "}
+
 class VMWriter:
+    # Instructions are kept as packed words (see pack) instead of formatted
+    # strings, so emitting an instruction is a table lookup and an append. Label and subroutine names are interned in self.names. Text
+    # is only produced when the code is saved.
     def __init__(self, output_path):
         self.output_path = output_path
-        self.lines = []
+        self.code = []
+        self.names = []
+        self._name_ids = {}
+
+    def name_id(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.names.append(name)
+            self._name_ids[name] = name_id
+        return name_id
 
     def write_push(self,segment,index):
-        self.lines.append(f"push {segment} {index}")
-    
+        self.code.append(_PUSH_WORDS[segment] | index << NUM_SHIFT)
+
     def write_pop(self,segment,index):
-        self.lines.append(f"pop {segment} {index}")
+        self.code.append(_POP_WORDS[segment] | index << NUM_SHIFT)
 
     def write_arithmetic(self,command):
-        self.lines.append(command)
+        self.code.append(_ARITHMETIC_WORDS[command])
 
     def write_label(self,label):
-        self.lines.append(f"label {label}")
+        self.code.append(_LABEL | self.name_id(label) << ARG_SHIFT)
 
     def write_goto(self,label):
-        self.lines.append(f"goto {label}")
+        self.code.append(_GOTO | self.name_id(label) << ARG_SHIFT)
 
     def write_if(self,label):
-        self.lines.append(f"if-goto {label}")
+        self.code.append(_IF_GOTO | self.name_id(label) << ARG_SHIFT)
 
     def write_call(self,name,n_args):
-        self.lines.append(f"call {name} {n_args}")
+        self.code.append(_CALL | self.name_id(name) << ARG_SHIFT | n_args << NUM_SHIFT)
 
     def write_function(self,name,n_locals):
-        self.lines.append(f"function {name} {n_locals}")
+        self.code.append(_FUNCTION | self.name_id(name) << ARG_SHIFT | n_locals << NUM_SHIFT)
 
     def write_return(self):
-        self.lines.append("return")
+        self.code.append(_RETURN)
 
     def write_comment(self,comment):
-        self.lines.append(f"// {comment}")
+        self.code.append(_COMMENT | self.name_id(comment) << ARG_SHIFT)
+
+    def __len__(self):
+        return len(self.code)
+
+    def cut(self, start):
+        # Removes and returns the instructions from position start on, so a
+        # caller can emit code out of source order and paste() it back later.
+        words = self.code[start:]
+        del self.code[start:]
+        return words
+
+    def paste(self, words):
+        self.code.extend(words)
+
+    def instructions(self):
+        # (op, arg, num) triples for analysis and optimization passes.
+        return [unpack(word) for word in self.code]
+
+    def set_instructions(self, instructions):
+        # Replaces the code with (op, arg, num) triples. Name ids must come
+        # from this writer; use name_id() to intern new ones.
+        self.code = [pack(op, arg, num) for op, arg, num in instructions]
+
+    def render(self, op, arg, num):
+        text = _FIXED_TEXT.get(op)
+        if text is not None:
+            return text
+        if op == _PUSH:
+            return f"push {SEGMENT_NAMES[arg]} {num}"
+        if op == _POP:
+            return f"pop {SEGMENT_NAMES[arg]} {num}"
+        if op in _COUNTED_PREFIX:
+            return f"{_COUNTED_PREFIX[op]}{self.names[arg]} {num}"
+        return f"{_NAMED_PREFIX[op]}{self.names[arg]}"
+
+    def iter_lines(self):
+        # Most instructions repeat verbatim (push local 0, add, ...), so each
+        # distinct word is only rendered once.
+        render = self.render
+        texts = {}
+        for word in self.code:
+            text = texts.get(word)
+            if text is None:
+                text = texts[word] = render(word & 0xFF, (word >> ARG_SHIFT) & _ARG_MASK, word >> NUM_SHIFT)
+            yield text
+
+    @property
+    def lines(self):
+        return list(self.iter_lines())
+
+    def text(self):
+        if not self.code:
+            return ""
+        return "\n".join(self.iter_lines()) + "\n"
 
-    def save(self):
-        with open(self.output_path,'w') as f:
-            for line in self.lines:
-                f.write(line + '\n')
-        self.lines = []
\ No newline at end of file
+    def save(self, stream=None):
+        # One bulk write of the whole file, to output_path or to any
+        # file-like object (io.StringIO, sys.stdout, an open bundle file).
+        text = self.text()
+        if stream is None:
+            with open(self.output_path,'w') as f:
+                f.write(text)
+        else:
+            stream.write(text)
+        self.code = []
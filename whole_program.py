@@ -0,0 +1,164 @@
+from collections import namedtuple
+
+# Whole-program dead function elimination. Works on the VM text of every
+# class in the build: a function is kept if it is reachable through `call`
+# instructions from one of the entry points. Jack has no dynamic dispatch, so
+# every call target is known statically. Calls to functions outside the
+# program (the OS when it is not part of the build) are simply leaves.
+
+ENTRY_POINTS = ("Main.main", "Sys.init")
+# The OS initializers Sys.init runs; kept whenever the program defines them,
+# even if its Sys.init is not part of the build.
+OS_ENTRY_POINTS = ("Memory.init", "Math.init", "Screen.init", "Output.init", "Keyboard.init")
+
+Function = namedtuple('Function', ['name', 'lines', 'calls'])
+Removed = namedtuple('Removed', ['name', 'out', 'instructions', 'bytes'])
+
+def split_functions(text):
+    # -> (lines before the first function, [Function, ...])
+    preamble = []
+    functions = []
+    current = None
+    for line in text.splitlines():
+        parts = line.split()
+        if parts and parts[0] == "function":
+            current = Function(parts[1], [line], set())
+            functions.append(current)
+        elif current is None:
+            preamble.append(line)
+        else:
+            current.lines.append(line)
+            if parts and parts[0] == "call":
+                current.calls.add(parts[1])
+    return preamble, functions
+
+def call_targets(text):
+    # Every function a piece of VM text calls, e.g. a prebuilt .vm file.
+    targets = set()
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) > 1 and parts[0] == "call":
+            targets.add(parts[1])
+    return targets
+
+def reachable(functions, roots):
+    graph = {f.name: f.calls for f in functions}
+    seen = set()
+    pending = [name for name in roots if name in graph]
+    while pending:
+        name = pending.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        pending.extend(callee for callee in graph[name] if callee in graph and callee not in seen)
+    return seen
+
+def instruction_count(lines):
+    return sum(1 for line in lines if line.strip() and not line.lstrip().startswith("//"))
+
+def eliminate_dead_functions(outputs, roots=ENTRY_POINTS, extra_roots=()):
+    # outputs is [(out_path, vm_text)] for the whole program. Returns the
+    # pruned list in the same order and the Removed functions. When no entry
+    # point is defined in the program nothing is removed, since every
+    # function could be called from outside. The OS initializers and
+    # extra_roots (calls made by code outside outputs, such as prebuilt .vm
+    # files) are always kept.
+    split = [(out, split_functions(text)) for out, text in outputs]
+    functions = [f for _, (_, fs) in split for f in fs]
+    if not any(f.name in roots for f in functions):
+        return list(outputs), None
+    live = reachable(functions, [*roots, *OS_ENTRY_POINTS, *extra_roots])
+    pruned = []
+    removed = []
+    for out, (preamble, fs) in split:
+        lines = list(preamble)
+        for f in fs:
+            if f.name in live:
+                lines.extend(f.lines)
+            else:
+                removed.append(Removed(f.name, out, instruction_count(f.lines), sum(len(line) + 1 for line in f.lines)))
+        pruned.append((out, "\n".join(lines) + "\n" if lines else ""))
+    return pruned, removed
+
+# Accessor inlining. A trivial accessor is a function whose whole body reads
+# or assigns one field or static:
+#   method getter    push argument 0, pop pointer 0, push this|static K, return
+#   method setter    push argument 0, pop pointer 0, push argument 1,
+#                    pop this|static K, push constant 0, return
+#   function getter  push static K, return
+#   function setter  push argument 0, pop static K, push constant 0, return
+# A matching `call` is replaced by direct accesses on the caller's stack:
+# fields go through `pointer 1`/`that`, which the generated code always sets
+# right before use. Statics are per file in the VM, so static accessors are
+# only inlined into their own class.
+
+Accessor = namedtuple('Accessor', ['name', 'out', 'n_args', 'code', 'uses_static'])
+
+_METHOD_PROLOGUE = ["push argument 0", "pop pointer 0"]
+
+def accessor_code(body):
+    # body is the function's instructions after the `function` line.
+    # -> (n_args, replacement instructions, uses_static), or None.
+    method = body[:2] == _METHOD_PROLOGUE
+    if method:
+        body = body[2:]
+    parts = [line.split() for line in body]
+    if len(parts) == 2 and parts[1] == ["return"] and len(parts[0]) == 3 and parts[0][0] == "push":
+        _, segment, index = parts[0]
+        if segment == "this" and method:
+            return 1, ["pop pointer 1", f"push that {index}"], False
+        if segment == "static":
+            return (1, ["pop temp 0", f"push static {index}"], True) if method else (0, [f"push static {index}"], True)
+    if (len(parts) == 4 and parts[0] == ["push", "argument", "1" if method else "0"] and parts[1][0] == "pop"
+            and len(parts[1]) == 3 and parts[2] == ["push", "constant", "0"] and parts[3] == ["return"]):
+        _, segment, index = parts[1]
+        if segment == "this" and method:
+            return 2, ["pop temp 0", "pop pointer 1", "push temp 0", f"pop that {index}", "push constant 0"], False
+        if segment == "static":
+            if method:
+                return 2, [f"pop static {index}", "pop temp 0", "push constant 0"], True
+            return 1, [f"pop static {index}", "push constant 0"], True
+    return None
+
+def find_accessors(outputs):
+    accessors = {}
+    for out, text in outputs:
+        for f in split_functions(text)[1]:
+            body = [line.strip() for line in f.lines[1:] if line.strip() and not line.lstrip().startswith("//")]
+            found = accessor_code(body)
+            if found is not None:
+                accessors[f.name] = Accessor(f.name, out, *found)
+    return accessors
+
+def inline_accessors(outputs):
+    # outputs is [(out_path, vm_text)] for the whole program. Returns the
+    # rewritten list in the same order and {accessor name: calls inlined}.
+    # The accessors themselves are kept; dead function elimination drops
+    # the ones nothing calls any more.
+    accessors = find_accessors(outputs)
+    inlined = {}
+    rewritten = []
+    for out, text in outputs:
+        lines = text.splitlines()
+        result = []
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            parts = line.split()
+            accessor = accessors.get(parts[1]) if len(parts) == 3 and parts[0] == "call" else None
+            if accessor is None or int(parts[2]) != accessor.n_args or (accessor.uses_static and accessor.out != out):
+                result.append(line)
+                i += 1
+                continue
+            code = accessor.code
+            i += 1
+            # `do obj.setX(v);` discards the return value right away. An array
+            # store also goes through temp 0 but follows it with `pop pointer 1`.
+            if (code[-1] == "push constant 0" and i < len(lines) and lines[i].strip() == "pop temp 0"
+                    and (i + 1 == len(lines) or lines[i + 1].strip() != "pop pointer 1")):
+                code = code[:-1]
+                i += 1
+            result.extend(code)
+            inlined[accessor.name] = inlined.get(accessor.name, 0) + 1
+        rewritten.append((out, "\n".join(result) + "\n" if result else ""))
+    return rewritten, inlined
@@ -0,0 +1,226 @@
+import os
+from collections import namedtuple
+from token_reader import write_token_file
+from jack_tokenizer import TOKEN_RE, KEYWORDS
+
+# Synthetic Jack programs for benchmarks. Generators yield (tag, value) pairs
+# in the same form TokenReader produces, so they can be written out as
+# *_myT.xml files of any size.
+
+def _symbols(text):
+    return [("symbol", c) for c in text]
+
+def _nested_tokens(n, depth):
+    # (y * 3) at depth 1; each further level wraps it as (y + (...)) or
+    # (y * (...)), alternating.
+    for level in range(depth, 0, -1):
+        yield ("symbol", "(")
+        yield ("identifier", "y")
+        yield ("symbol", "*" if level % 2 else "+")
+    yield ("integerConstant", str(n % 100))
+    yield from _symbols(")" * depth)
+
+def _statement_tokens(n, depth=1, string_length=0):
+    # let x = x + (y * 3) - a[i];
+    # With a string length, each statement is followed by
+    # do Output.printString("aaa...");
+    yield ("keyword", "let")
+    yield ("identifier", "x")
+    yield ("symbol", "=")
+    yield ("identifier", "x")
+    yield ("symbol", "+")
+    yield from _nested_tokens(n, depth)
+    yield ("symbol", "-")
+    yield ("identifier", "a")
+    yield ("symbol", "[")
+    yield ("identifier", "i")
+    yield ("symbol", "]")
+    yield ("symbol", ";")
+    if string_length:
+        yield ("keyword", "do")
+        yield ("identifier", "Output")
+        yield ("symbol", ".")
+        yield ("identifier", "printString")
+        yield ("symbol", "(")
+        yield ("stringConstant", "a" * string_length)
+        yield from _symbols(");")
+
+STATEMENT_TOKENS = 16
+
+def statement_token_count(depth=1, string_length=0):
+    return STATEMENT_TOKENS + 4 * (depth - 1) + (8 if string_length else 0)
+
+def subroutine_tokens(name, statements, depth=1, string_length=0):
+    yield ("keyword", "function")
+    yield ("keyword", "int")
+    yield ("identifier", name)
+    yield from _symbols("(){")
+    yield ("keyword", "var")
+    yield ("keyword", "int")
+    for i, var in enumerate(("x", "y", "i")):
+        if i:
+            yield ("symbol", ",")
+        yield ("identifier", var)
+    yield ("symbol", ";")
+    yield ("keyword", "var")
+    yield ("identifier", "Array")
+    yield ("identifier", "a")
+    yield ("symbol", ";")
+    for n in range(statements):
+        yield from _statement_tokens(n, depth, string_length)
+    yield ("keyword", "return")
+    yield ("identifier", "x")
+    yield from _symbols(";}")
+
+def class_tokens(class_name, subroutines, statements, depth=1, string_length=0):
+    yield ("keyword", "class")
+    yield ("identifier", class_name)
+    yield ("symbol", "{")
+    for i in range(subroutines):
+        yield from subroutine_tokens(f"f{i}", statements, depth, string_length)
+    yield ("symbol", "}")
+
+def class_tokens_of_size(class_name, n_tokens, statements=50):
+    # Enough subroutines of `statements` statements each to reach n_tokens.
+    per_subroutine = STATEMENT_TOKENS * statements + 22
+    subroutines = max(1, -(-n_tokens // per_subroutine))
+    return class_tokens(class_name, subroutines, statements)
+
+def write_jack_file(path, tokens):
+    # Renders the same token stream as Jack source, one statement per line.
+    count = 0
+    with open(path, 'w') as f:
+        for tag, value in tokens:
+            if tag == "stringConstant":
+                value = f'"{value}"'
+            f.write(value)
+            f.write("\n" if value in (";", "{", "}") else " ")
+            count += 1
+    return count
+
+# A point in the benchmark space: `classes` files, each with `subroutines`
+# functions of `statements` statements; `depth` is the parenthesis nesting of
+# each statement's expression and `string_length` the length of the string
+# literal printed after it (0 = no strings).
+Workload = namedtuple('Workload', ['classes', 'subroutines', 'statements', 'depth', 'string_length'])
+
+DEFAULT_WORKLOAD = Workload(classes=4, subroutines=20, statements=50, depth=1, string_length=0)
+
+def write_workload(directory, workload):
+    # Writes C0_myT.xml ... C{n-1}_myT.xml and returns the total token count.
+    total = 0
+    for i in range(workload.classes):
+        name = f"C{i}"
+        total += write_token_file(os.path.join(directory, f"{name}_myT.xml"),
+                                  class_tokens(name, workload.subroutines, workload.statements,
+                                               workload.depth, workload.string_length))
+    return total
+
+NESTING_SHAPES = ("parens", "unary", "index", "call")
+
+def nested_expression_tokens(shape, depth):
+    # One expression nested `depth` levels deep in the given shape:
+    # parens (y + (y * (...))), unary - ~ - ~ y, index a[a[...]],
+    # call Main.f(Main.f(...)).
+    if shape == "parens":
+        yield from _nested_tokens(depth, depth)
+        return
+    for level in range(depth):
+        if shape == "unary":
+            yield ("symbol", "-" if level % 2 else "~")
+        elif shape == "index":
+            yield ("identifier", "a")
+            yield ("symbol", "[")
+        else:
+            yield ("identifier", "Main")
+            yield ("symbol", ".")
+            yield ("identifier", "f")
+            yield ("symbol", "(")
+    yield ("identifier", "y")
+    if shape == "index":
+        yield from _symbols("]" * depth)
+    elif shape == "call":
+        yield from _symbols(")" * depth)
+
+def nested_class_tokens(class_name, shape, depth):
+    # function int f(int y) { var Array a; let y = <nested>; return y; }
+    yield ("keyword", "class")
+    yield ("identifier", class_name)
+    yield ("symbol", "{")
+    yield ("keyword", "function")
+    yield ("keyword", "int")
+    yield ("identifier", "f")
+    yield ("symbol", "(")
+    yield ("keyword", "int")
+    yield ("identifier", "y")
+    yield from _symbols("){")
+    yield ("keyword", "var")
+    yield ("identifier", "Array")
+    yield ("identifier", "a")
+    yield ("symbol", ";")
+    yield ("keyword", "let")
+    yield ("identifier", "y")
+    yield ("symbol", "=")
+    yield from nested_expression_tokens(shape, depth)
+    yield ("symbol", ";")
+    yield ("keyword", "return")
+    yield ("identifier", "y")
+    yield from _symbols(";}}")
+
+# Array-heavy subroutines for comparing array store lowerings: fill, copy,
+# bubble sort and screen-buffer style loops. {n} numbers each copy.
+_ARRAY_SUBROUTINES = """
+    function void fill{n}(Array a, int size, int value) {
+        var int i;
+        let i = 0;
+        while (i < size) { let a[i] = value; let i = i + 1; }
+        return;
+    }
+    function void copy{n}(Array dst, Array src, int size) {
+        var int i, x;
+        let i = 0;
+        while (i < size) { let x = src[i]; let dst[i] = x; let dst[i + size] = src[i]; let i = i + 1; }
+        return;
+    }
+    function void sort{n}(Array a, int size) {
+        var int i, j, t;
+        let i = 0;
+        while (i < size) {
+            let j = 0;
+            while (j < (size - 1 - i)) {
+                if (a[j] > a[j + 1]) { let t = a[j]; let a[j] = a[j + 1]; let a[j + 1] = t; }
+                let j = j + 1;
+            }
+            let i = i + 1;
+        }
+        return;
+    }
+    function void clear{n}(int rows) {
+        var Array screen; var int row, col;
+        let screen = 16384;
+        let row = 0;
+        while (row < rows) {
+            let col = 0;
+            while (col < 32) { let screen[(row * 32) + col] = 0; let screen[(row * 32) + col + 512] = -1; let col = col + 1; }
+            let row = row + 1;
+        }
+        return;
+    }
+"""
+
+def _source_tokens(text):
+    # Tokens of a Jack snippet, as iter_jack_tokens yields them for a file.
+    for m in TOKEN_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == "word":
+            yield ("keyword" if m.group(kind) in KEYWORDS else "identifier"), m.group(kind)
+        elif kind != "skip":
+            yield kind, m.group(kind)
+
+def array_class_tokens(class_name, copies):
+    yield ("keyword", "class")
+    yield ("identifier", class_name)
+    yield ("symbol", "{")
+    for n in range(copies):
+        yield from _source_tokens(_ARRAY_SUBROUTINES.replace("{n}", str(n)))
+    yield ("symbol", "}")